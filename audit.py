@@ -0,0 +1,82 @@
+from logging import Logger
+
+import time
+import asyncio
+
+from persistence import getDatabase, getAsyncDatabase
+
+_TRAIL: "AuditTrail" = None
+
+# namespace of the audit events, keyed by ids that increase with time
+AUDIT = "audit"
+
+def setup(logger:Logger, retention:float=90 * 24 * 3600) -> None:
+    global _TRAIL
+    _TRAIL = AuditTrail(logger, retention)
+
+class AuditTrailNotReadyException(Exception):
+    pass
+
+def getAuditTrail() -> "AuditTrail":
+    global _TRAIL
+    if _TRAIL is None:
+        raise AuditTrailNotReadyException()
+    return _TRAIL
+
+class AuditTrail:
+    """
+    Keeps a record of every change made with an admin command in the database for retention seconds.
+    Each event is also logged with the event attached to the log record as audit, which the
+    ops shipper forwards to the ops chat.
+    """
+    PRUNE_INTERVAL = 24 * 3600
+
+    def __init__(self, logger:Logger, retention:float=90 * 24 * 3600) -> None:
+        self._logger = logger
+        self._retention = retention
+        self._lastId = 0
+        self._task: asyncio.Task = None
+
+    async def start(self) -> None:
+        """
+        Prunes expired events now and then every PRUNE_INTERVAL seconds, unless retention is 0.
+        """
+        if self._retention > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                pruned = await self.prune()
+                if pruned > 0:
+                    self._logger.info(f"pruned {pruned} audit events older than {self._retention / 86400:g} days")
+            except Exception as e:
+                self._logger.error(f"failed to prune the audit trail: {e}")
+            await asyncio.sleep(self.PRUNE_INTERVAL)
+
+    def _nextId(self) -> str:
+        # ids are milliseconds since the epoch, so the store lists the events in the order they happened
+        self._lastId = max(self._lastId + 1, int(time.time() * 1000))
+        return str(self._lastId) + getDatabase().idSuffix
+
+    async def record(self, username:str, action:str, target:str, message:str) -> None:
+        """
+        Records that username performed action on target, e.g. a unit code or a username, and logs message.
+        """
+        event = {"at": time.time(), "user": username, "action": action, "target": target, "message": message}
+        await getAsyncDatabase().putValue(AUDIT, self._nextId(), event)
+        self._logger.info(message, extra={"audit": event})
+
+    async def prune(self) -> int:
+        db = getAsyncDatabase()
+        expiry = time.time() - self._retention
+        expired = [eventId for eventId, event in await db.getValues(AUDIT) if event["at"] < expiry]
+        for eventId in expired:
+            await db.deleteValue(AUDIT, eventId)
+        return len(expired)
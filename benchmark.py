@@ -0,0 +1,327 @@
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+
+from aiohttp import web, ClientSession
+import telebot
+import telebot.asyncio_helper
+
+import config
+import service
+import persistence
+
+COMMANDS = ["get_all", "get_one", "add", "update", "rm"]
+
+class FakeBotAPI:
+    """
+    In-process stand-in for the Telegram Bot API server.
+    Serves getUpdates and sendMessage (and acknowledges the other methods the bot calls)
+    and records how long each synthetic update waited for its first reply.
+    """
+    BOT = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+
+    def __init__(self, host:str="127.0.0.1", port:int=18081) -> None:
+        self._host = host
+        self._port = port
+        self._updates: List[dict] = []
+        self._newUpdates = asyncio.Event()
+        self._messageId = 1000000
+        self._outstanding: Dict[Tuple[int, int], Tuple[str, float]] = {}
+        self.latencies: Dict[str, List[float]] = {command: [] for command in COMMANDS}
+        self.sent = 0
+        self._runner: web.AppRunner = None
+
+    @property
+    def apiUrl(self) -> str:
+        return f"http://{self._host}:{self._port}/bot{{0}}/{{1}}"
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+    def track(self, command:str, update:dict) -> None:
+        message = update["message"]
+        self._outstanding[(message["chat"]["id"], message["message_id"])] = (command, time.monotonic())
+
+    def push(self, command:str, update:dict) -> None:
+        self.track(command, update)
+        self._updates.append(update)
+        self._newUpdates.set()
+
+    @property
+    def outstanding(self) -> int:
+        return len(self._outstanding)
+
+    async def _params(self, request:web.Request) -> dict:
+        params = dict(request.query)
+        if request.content_type == "multipart/form-data":
+            params.update({key: value for key, value in (await request.post()).items()})
+        else:
+            params.update(dict(parse_qsl((await request.read()).decode())))
+        return params
+
+    async def _handle(self, request:web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        if method == "getMe":
+            return self._ok(self.BOT)
+        if method == "getUpdates":
+            return self._ok(await self._getUpdates(params))
+        if method in ("sendMessage", "sendDocument", "editMessageText"):
+            return self._ok(self._sendMessage(params))
+        return self._ok(True)
+
+    def _ok(self, result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    async def _getUpdates(self, params:dict) -> List[dict]:
+        offset = int(params.get("offset") or 0)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            self._newUpdates.clear()
+            try:
+                await asyncio.wait_for(self._newUpdates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                return []
+        return self._updates[:int(params.get("limit") or 100)]
+
+    def _sendMessage(self, params:dict) -> dict:
+        self.sent += 1
+        chatId = int(params.get("chat_id", 0))
+        replyTo = params.get("reply_to_message_id")
+        if "reply_parameters" in params:
+            replyTo = json.loads(params["reply_parameters"]).get("message_id")
+        if replyTo is not None:
+            tracked = self._outstanding.pop((chatId, int(replyTo)), None)
+            if tracked is not None:
+                command, started = tracked
+                self.latencies[command].append(time.monotonic() - started)
+        self._messageId += 1
+        return {
+            "message_id": self._messageId,
+            "date": int(time.time()),
+            "chat": {"id": chatId, "type": "private"},
+            "from": self.BOT,
+            "text": params.get("text", ""),
+        }
+
+class UpdateGenerator:
+    """
+    Produces synthetic command updates with a configurable command mix and number of users.
+    The first admins users are administrators and send every write command.
+    """
+    def __init__(self, codes:List[str], mix:Dict[str, float], users:int, admins:int, seed:int=0) -> None:
+        self._random = random.Random(seed)
+        self._codes = codes
+        self._commands = list(mix)
+        self._weights = [mix[command] for command in self._commands]
+        self._users = users
+        self._admins = admins
+        self._updateId = 0
+        self._added = 0
+
+    @staticmethod
+    def adminNames(admins:int) -> List[str]:
+        return [f"admin{i}" for i in range(admins)]
+
+    def next(self) -> Tuple[str, dict]:
+        command = self._random.choices(self._commands, self._weights)[0]
+        if command == "get_all":
+            text = "/get all"
+        elif command == "get_one":
+            text = f"/get {self._random.choice(self._codes)}"
+        elif command == "add":
+            self._added += 1
+            text = f"/add ZZZ{self._added % 1000:03d} https://t.me/+benchmark{self._added} Benchmark Unit {self._added}"
+        elif command == "update":
+            code = self._random.choice(self._codes)
+            if self._random.random() < 0.5:
+                text = f"/update {code} link https://t.me/+updated{self._updateId}"
+            else:
+                text = f"/update {code} name Updated{self._updateId}"
+        else:
+            text = f"/rm ZZZ{self._random.randrange(1000):03d}"
+        if command in ("add", "update", "rm"):
+            user = self._random.randrange(self._admins)
+            username = f"admin{user}"
+        else:
+            user = self._admins + self._random.randrange(self._users)
+            username = f"user{user}"
+        self._updateId += 1
+        chatId = 1000 + user
+        return command, {
+            "update_id": self._updateId,
+            "message": {
+                "message_id": self._updateId,
+                "date": int(time.time()),
+                "chat": {"id": chatId, "type": "private"},
+                "from": {"id": chatId, "is_bot": False, "first_name": username, "username": username},
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+            },
+        }
+
+def seedDatabase(groups:int, seed:int=0) -> List[str]:
+    rng = random.Random(seed)
+    db = persistence.getDatabase()
+    prefixes = sorted({"".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXY") for _ in range(3)) for _ in range(max(1, groups // 40))})
+    codes = []
+    for i in range(groups):
+        code = f"{prefixes[i % len(prefixes)]}{100 + i // len(prefixes):03d}"
+        db.addTelegramGroup(code, f"Benchmark Unit {i}", f"https://t.me/+seed{i}")
+        codes.append(code)
+    return codes
+
+def percentile(values:List[float], p:float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+def parseMix(text:str) -> Dict[str, float]:
+    mix = {}
+    for item in text.split(","):
+        command, weight = item.split("=")
+        if command not in COMMANDS:
+            raise ValueError(f"unknown command {command} in mix, expected one of {', '.join(COMMANDS)}")
+        mix[command] = float(weight)
+    return mix
+
+async def benchmark(args:argparse.Namespace) -> dict:
+    # the database and its journal are removed with the directory once the run is over
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        return await _benchmark(args, workdir)
+
+async def _benchmark(args:argparse.Namespace, workdir:str) -> dict:
+    api = FakeBotAPI(port=args.api_port)
+    await api.start()
+    telebot.asyncio_helper.API_URL = api.apiUrl
+    admins = UpdateGenerator.adminNames(args.admins)
+    secret = "benchmark"
+    cfg = config.Config(
+        token="123456:BENCHMARK",
+        admins=admins,
+        database=os.path.join(workdir, "database.db"),
+        backend=args.backend,
+        mode=args.mode,
+        webhookUrl=f"http://127.0.0.1:{args.webhook_port}/webhook",
+        webhookHost="127.0.0.1",
+        webhookPort=args.webhook_port,
+        webhookSecret=secret,
+        sendGlobalRate=args.send_global_rate,
+        sendChatRate=args.send_chat_rate,
+        sendChatBurst=args.send_chat_burst,
+        # the synthetic users would otherwise be throttled like spammers
+        floodLimit=0,
+        floodCommandLimits={},
+        floodInteractiveLimit=0,
+        # the seeded invite links are made up, and checking them would reach the real t.me
+        linkCheckInterval=0,
+    )
+    persistence.setup(cfg.database, cfg.admins, cfg.backend, cfg.readers, cfg.journal, cfg.journalCheckpoint)
+    codes = seedDatabase(args.groups, args.seed)
+    bot = service.SingletonService(cfg, logging.getLogger("benchmark"))
+    serving = asyncio.create_task(bot.serve())
+    generator = UpdateGenerator(codes, parseMix(args.mix), args.users, args.admins, args.seed)
+
+    session = ClientSession() if args.mode == "webhook" else None
+    await asyncio.sleep(0.5)
+    started = time.monotonic()
+    try:
+        for i in range(args.updates):
+            command, update = generator.next()
+            if session is not None:
+                api.track(command, update)
+                await session.post(cfg.webhookUrl, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+            else:
+                api.push(command, update)
+            if args.rate > 0:
+                delay = started + (i + 1) / args.rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        deadline = time.monotonic() + args.timeout
+        while api.outstanding > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.monotonic() - started
+    finally:
+        if session is not None:
+            await session.close()
+        serving.cancel()
+        await asyncio.gather(serving, return_exceptions=True)
+        await api.stop()
+
+    completed = sum(len(latencies) for latencies in api.latencies.values())
+    return {
+        "config": {
+            "mode": args.mode,
+            "backend": args.backend,
+            "groups": args.groups,
+            "users": args.users,
+            "admins": args.admins,
+            "updates": args.updates,
+            "rate": args.rate,
+            "mix": parseMix(args.mix),
+            "seed": args.seed,
+        },
+        "elapsed": elapsed,
+        "completed": completed,
+        "unanswered": api.outstanding,
+        "messages_sent": api.sent,
+        "throughput": completed / elapsed if elapsed > 0 else 0.0,
+        "commands": {
+            command: {
+                "count": len(latencies),
+                "p50": percentile(latencies, 0.50),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+            }
+            for command, latencies in api.latencies.items() if latencies
+        },
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the bot against an in-process fake Telegram Bot API server.")
+    parser.add_argument("--groups", type=int, default=500, help="number of telegram groups seeded into the database")
+    parser.add_argument("--users", type=int, default=200, help="number of distinct non-admin users")
+    parser.add_argument("--admins", type=int, default=2, help="number of admin users sending write commands")
+    parser.add_argument("--updates", type=int, default=2000, help="number of updates to send")
+    parser.add_argument("--rate", type=float, default=0, help="updates per second, 0 sends them as fast as possible")
+    parser.add_argument("--mix", default="get_all=0.3,get_one=0.6,add=0.04,update=0.04,rm=0.02",
+                        help="comma separated command weights")
+    parser.add_argument("--backend", choices=["shelve", "sqlite"], default="shelve")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--send-global-rate", type=float, default=1000000, help="global flood limit, unlimited by default")
+    parser.add_argument("--send-chat-rate", type=float, default=1000000, help="per chat flood limit, unlimited by default")
+    parser.add_argument("--send-chat-burst", type=float, default=1000000)
+    parser.add_argument("--api-port", type=int, default=18081)
+    parser.add_argument("--webhook-port", type=int, default=18082)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for outstanding replies")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the JSON results to, stdout by default")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(benchmark(args))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from logging import Logger
+
+import time
+import asyncio
+
+from persistence import getDatabase, getAsyncDatabase
+from metrics import getMetrics
+
+_METRICS = getMetrics()
+
+_BROADCASTER: "Broadcaster" = None
+
+# namespace of the broadcasts that have not finished yet
+BROADCASTS = "broadcasts"
+
+# sends texts to a chat and returns whether they were delivered
+Send = Callable[[int, List[str]], Awaitable[bool]]
+
+def setup(send:Send, logger:Logger, workers:int=8) -> None:
+    global _BROADCASTER
+    _BROADCASTER = Broadcaster(send, logger, workers)
+
+class BroadcasterNotReadyException(Exception):
+    pass
+
+def getBroadcaster() -> "Broadcaster":
+    global _BROADCASTER
+    if _BROADCASTER is None:
+        raise BroadcasterNotReadyException()
+    return _BROADCASTER
+
+class Broadcaster:
+    """
+    Fans a message out to many telegram groups.
+    At most workers sends are in flight at once so that a broadcast never fills the send queue
+    ahead of the replies to users. The flood limits are kept by the send queue itself.
+    Progress is saved every SAVE_INTERVAL seconds, and a broadcast interrupted by a restart
+    resumes where it stopped, sending again at most what was delivered since the last save.
+    """
+    SAVE_INTERVAL = 1.0
+    MAX_FAILURES_LISTED = 50
+
+    def __init__(self, send:Send, logger:Logger, workers:int=8) -> None:
+        self._send = send
+        self._logger = logger
+        self._workers = workers
+        self._tasks: Dict[str, asyncio.Task] = {}
+        _METRICS.gauge("bot_broadcasts_running", lambda: len(self._tasks), "broadcasts being sent")
+
+    async def start(self, chatId:int, text:str, targets:List[Tuple[str, int]]) -> str:
+        """
+        Starts sending text to the (unit code, chat id) targets and returns the id of the broadcast.
+        The summary is sent to chatId when every target has been tried.
+        """
+        stamp = int(time.time() * 1000)
+        broadcastId = f"{stamp}{getDatabase().idSuffix}"
+        while broadcastId in self._tasks:
+            stamp += 1
+            broadcastId = f"{stamp}{getDatabase().idSuffix}"
+        job = {"chat": chatId, "text": text, "targets": [list(target) for target in targets], "results": {}}
+        await getAsyncDatabase().putValue(BROADCASTS, broadcastId, job)
+        self._spawn(broadcastId, job)
+        return broadcastId
+
+    async def resume(self, primary:bool=True) -> int:
+        """
+        Restarts the broadcasts left unfinished by the previous run and returns how many there were.
+        Processes sharing the database each resume the broadcasts they started, and the primary
+        process also those started without several processes.
+        """
+        suffix = getDatabase().idSuffix
+        jobs = [(broadcastId, job) for broadcastId, job in await getAsyncDatabase().getValues(BROADCASTS)
+                if broadcastId.endswith(suffix) or (primary and "." not in broadcastId)]
+        for broadcastId, job in jobs:
+            if broadcastId not in self._tasks:
+                self._logger.info(f"resuming broadcast {broadcastId}, {len(job['results'])} of {len(job['targets'])} groups done")
+                self._spawn(broadcastId, job)
+        return len(jobs)
+
+    async def stop(self) -> None:
+        """
+        Stops the broadcasts being sent. Their progress is saved so that the next run resumes them.
+        """
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, broadcastId:str, job:Dict[str, Any]) -> None:
+        task = asyncio.create_task(self._run(broadcastId, job))
+        self._tasks[broadcastId] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcastId, None))
+
+    async def _save(self, broadcastId:str, job:Dict[str, Any]) -> None:
+        # a copy, because the results keep changing while the writer thread serialises them
+        await getAsyncDatabase().putValue(BROADCASTS, broadcastId, dict(job, results=dict(job["results"])))
+
+    async def _run(self, broadcastId:str, job:Dict[str, Any]) -> None:
+        results: Dict[str, bool] = job["results"]
+        pending = [(unitCode, chatId) for unitCode, chatId in job["targets"] if unitCode not in results]
+
+        async def work() -> None:
+            while pending:
+                unitCode, chatId = pending.pop()
+                try:
+                    sent = await self._send(chatId, [job["text"]])
+                except Exception as e:
+                    self._logger.error(f"broadcast {broadcastId} failed for {unitCode}: {e}")
+                    sent = False
+                results[unitCode] = sent
+                _METRICS.inc("bot_broadcast_sends_total", help="broadcast messages by result", result="sent" if sent else "failed")
+
+        async def saveProgress() -> None:
+            while True:
+                await asyncio.sleep(self.SAVE_INTERVAL)
+                await self._save(broadcastId, job)
+
+        pending.reverse()
+        saver = asyncio.create_task(saveProgress())
+        try:
+            await asyncio.gather(*[work() for _ in range(max(1, min(self._workers, len(pending))))])
+        except asyncio.CancelledError:
+            saver.cancel()
+            await self._save(broadcastId, job)
+            raise
+        saver.cancel()
+        await getAsyncDatabase().deleteValue(BROADCASTS, broadcastId)
+        self._logger.info(f"broadcast {broadcastId} finished")
+        await self._send(job["chat"], [self.summary(broadcastId, job)])
+
+    def summary(self, broadcastId:str, job:Dict[str, Any]) -> str:
+        results: Dict[str, bool] = job["results"]
+        failed = sorted(unitCode for unitCode, sent in results.items() if not sent)
+        lines = [f"Broadcast {broadcastId} finished. Sent to {len(results) - len(failed)} of {len(job['targets'])} telegram groups."]
+        if len(failed) > 0:
+            lines.append(f"Failed for {', '.join(failed[:self.MAX_FAILURES_LISTED])}")
+            if len(failed) > self.MAX_FAILURES_LISTED:
+                lines.append(f"and {len(failed) - self.MAX_FAILURES_LISTED} more.")
+        return "\n".join(lines)
@@ -0,0 +1,113 @@
+from typing import Iterable, Iterator, Tuple
+
+import io
+import csv
+import json
+
+class UnsupportedFormatException(Exception):
+    def __init__(self, filename:str) -> None:
+        super().__init__(f"{filename} is neither a CSV nor a JSON document")
+
+class BadRowException(Exception):
+    pass
+
+# a row is (row number, unit code, unit name, link)
+Row = Tuple[int, str, str, str]
+
+_CODE_KEYS = ("unit_code", "unitcode", "code")
+_NAME_KEYS = ("unit_name", "unitname", "name")
+_LINK_KEYS = ("link",)
+
+def _field(record:dict, keys:Tuple[str, ...]) -> str:
+    for key, value in record.items():
+        if str(key).strip().lower() in keys:
+            return "" if value is None else str(value).strip()
+    raise BadRowException(f"missing {keys[0]}")
+
+def _fromRecord(number:int, record) -> Row:
+    if not isinstance(record, dict):
+        raise BadRowException("not a JSON object")
+    return number, _field(record, _CODE_KEYS).upper(), _field(record, _NAME_KEYS), _field(record, _LINK_KEYS)
+
+def _readCSV(data:bytes) -> Iterator[Tuple[int, object]]:
+    reader = csv.reader(io.StringIO(data.decode("utf-8-sig"), newline=""))
+    header = None
+    first = True
+    for number, cells in enumerate(reader, start=1):
+        if not cells or all(cell.strip() == "" for cell in cells):
+            continue
+        # the header is the first row with any cells, blank lines may come before it
+        if first and any(cell.strip().lower() in _CODE_KEYS for cell in cells):
+            first = False
+            header = cells
+            continue
+        first = False
+        if header is not None:
+            yield number, dict(zip(header, cells))
+        elif len(cells) < 3:
+            yield number, BadRowException("expected unit code, link and unit name")
+        else:
+            # without a header the columns follow /add: unit code, link, unit name
+            yield number, {"unit_code": cells[0], "link": cells[1], "unit_name": ",".join(cells[2:])}
+
+def _readJSON(data:bytes) -> Iterator[Tuple[int, object]]:
+    text = data.decode("utf-8-sig")
+    decoder = json.JSONDecoder()
+    i = len(text) - len(text.lstrip())
+    if text[i:i + 1] != "[":
+        # JSON Lines, one object per line
+        for number, line in enumerate(io.StringIO(text), start=1):
+            if line.strip() == "":
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, BadRowException(f"invalid JSON: {e.msg}")
+        return
+    # a JSON array is decoded one element at a time rather than as a whole
+    i += 1
+    number = 0
+    while True:
+        while i < len(text) and text[i] in " \t\r\n,":
+            i += 1
+        if i >= len(text):
+            yield number + 1, BadRowException("unterminated JSON array")
+            return
+        if text[i] == "]":
+            return
+        number += 1
+        try:
+            record, i = decoder.raw_decode(text, i)
+        except ValueError as e:
+            yield number, BadRowException(f"invalid JSON: {e.msg}")
+            return
+        yield number, record
+
+def readGroups(filename:str, data:bytes) -> Iterator[Tuple[int, object]]:
+    """
+    Lazily yields (row number, Row or BadRowException) for every row of a CSV, JSON array or JSON Lines document.
+    """
+    name = filename.lower()
+    if name.endswith(".csv"):
+        records = _readCSV(data)
+    elif name.endswith(".json") or name.endswith(".jsonl"):
+        records = _readJSON(data)
+    else:
+        raise UnsupportedFormatException(filename)
+    # both readers decode the whole document before the first row, so a decoding error never leaves a partial import
+    for number, record in records:
+        if isinstance(record, BadRowException):
+            yield number, record
+            continue
+        try:
+            yield number, _fromRecord(number, record)
+        except BadRowException as e:
+            yield number, e
+
+def writeGroups(rows:Iterable[Tuple[str, str, str]]) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["unit_code", "unit_name", "link"])
+    for unitCode, unitName, link in rows:
+        writer.writerow([unitCode, unitName, link])
+    return out.getvalue().encode("utf-8")
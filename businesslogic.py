@@ -1,27 +1,67 @@
-from typing import List
+from typing import Callable, List, Optional, Tuple
 from shelve import Shelf
 from logging import Logger
+from datetime import datetime
 
+import re
+import time
+import asyncio
+import functools
 import telebot 
 from telebot.async_telebot import AsyncTeleBot
 import telebot.async_telebot
 
-from persistence import getDatabase, TelegramGroup
+from persistence import getAsyncDatabase
+from bulk import readGroups, writeGroups, UnsupportedFormatException
+from metrics import getMetrics
+from broadcast import getBroadcaster
+from reminders import getReminderScheduler
+from linkhealth import getLinkChecker
+from audit import getAuditTrail
+import rbac
+from persistence import validateTelegramGroup
 from persistence import MalformedUnitCodeException, NoTelegramGroupException, BadTelegramLinkException, BadUnitNameException
 
+# callback data prefix of the /get all inline keyboard
+BROWSE = "getall"
+MAX_PREFIX_BUTTONS = 90
+# Telegram accepts at most 50 results per answer to an inline query
+INLINE_RESULTS = 50
+
 class NonAdminUserException(Exception):
     def __init__(self, username, fullname):
         super().__init__(f"{username} {fullname} is not an administrator")
 
+def requires(permission:str) -> Callable:
+    """
+    Decorates an Admin method so that it raises NonAdminUserException unless the user holds permission.
+    """
+    def decorator(fn:Callable) -> Callable:
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(self:"Admin", *args, **kwargs):
+                self.require(permission)
+                return await fn(self, *args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(self:"Admin", *args, **kwargs):
+                self.require(permission)
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 class User:
     def __init__(self, username:str, fullname:str, logger:Logger):
         self._username = username
         self._fullname = fullname
-        self._db = getDatabase()
+        self._db = getAsyncDatabase()
         self._logger = logger
     
     def isAdmin(self) -> bool:
-        return self._username in self._db.getAdmins()
+        """
+        True when the user holds any role.
+        """
+        return len(self._db.getPermissions(self._username)) > 0
 
     def welcome(self, message:telebot.types.Message) -> List[str]:
         return ["\n".join([
@@ -31,39 +71,114 @@ class User:
             "Enter /help to see what commands are available."
         ])]
 
-    def get(self, message:telebot.types.Message) -> List[str]:
+    async def get(self, message:telebot.types.Message) -> List[str]:
         tokens = message.text.split()
         unitCode = tokens[1].upper()
         if unitCode == "ALL":
-            tgs = sorted(self._db.getTelegramGroups())
-            if len(tgs) == 0:
+            replies = await self._db.getTelegramGroupReplies()
+            if len(replies) == 0:
                 return ["No telegram groups available."]
-            else:
-                prefix = tgs[0].prefix
-                lines = []
-                replies = []
-                for tg in tgs:
-                    if tg.prefix != prefix:
-                        replies.append("\n".join(lines))
-                        lines = []
-                        prefix = tg.prefix
-                    lines.append(f"{tg.unitCode} {tg.unitName}")
-                    lines.append(tg.link)
-                    lines.append("")
-                if len(lines) > 0:
-                    replies.append("\n".join(lines))
-                    lines = []
-                return replies
+            return replies
         else:
             try:
-                tg = self._db.getTelegramGroup(unitCode)
+                tg = await self._db.getTelegramGroup(unitCode)
             except MalformedUnitCodeException:
                 return [f"Fail because {unitCode} is a malformed unit code,"]
             except NoTelegramGroupException:
                 return [f"Fail because no known telegram group for {unitCode}"]
             else:
+                if tg.healthy is False:
+                    return [f"Click {tg.link} to join {tg.unitCode} {tg.unitName}\n\nThis link may have expired. Contact an administrator if it does not work."]
                 return [f"Click {tg.link} to join {tg.unitCode} {tg.unitName}"]
 
+    async def browse(self, page:int=0, prefix:Optional[str]=None) -> Tuple[str, Optional[telebot.types.InlineKeyboardMarkup]]:
+        """
+        Returns one page of /get all and the inline keyboard to move to other pages.
+        """
+        pages = await self._db.getTelegramGroupPages()
+        if len(pages) == 0:
+            return "No telegram groups available.", None
+        if prefix is not None:
+            page = next((i for i, (p, _) in enumerate(pages) if p == prefix.upper()), 0)
+        page = max(0, min(page, len(pages) - 1))
+        current, text = pages[page]
+        markup = telebot.types.InlineKeyboardMarkup()
+        navigation = []
+        if page > 0:
+            navigation.append(telebot.types.InlineKeyboardButton("« Prev", callback_data=f"{BROWSE}:{page - 1}"))
+        navigation.append(telebot.types.InlineKeyboardButton(f"{page + 1}/{len(pages)}", callback_data=f"{BROWSE}:noop"))
+        if page < len(pages) - 1:
+            navigation.append(telebot.types.InlineKeyboardButton("Next »", callback_data=f"{BROWSE}:{page + 1}"))
+        markup.row(*navigation)
+        prefixes = list(dict.fromkeys(p for p, _ in pages))[:MAX_PREFIX_BUTTONS]
+        buttons = [
+            telebot.types.InlineKeyboardButton(f"[{p}]" if p == current else p, callback_data=f"{BROWSE}:prefix:{p}")
+            for p in prefixes
+        ]
+        for i in range(0, len(buttons), 5):
+            markup.row(*buttons[i:i + 5])
+        return text, markup
+
+    def search(self, message:telebot.types.Message, limit:int=10) -> List[str]:
+        query = " ".join(message.text.split()[1:])
+        if len(query) == 0:
+            return ["Fail because no search text is given. Try /search [unit code or name]"]
+        tgs = self._db.searchTelegramGroups(query, limit)
+        if len(tgs) == 0:
+            return [f"No telegram groups match {query}."]
+        lines = []
+        for tg in tgs:
+            lines.append(f"{tg.unitCode} {tg.unitName}")
+            lines.append(tg.link)
+            lines.append("")
+        return ["\n".join(lines)]
+
+    def inline(self, query:str, offset:str="", limit:int=INLINE_RESULTS) -> Tuple[List[telebot.types.InlineQueryResultArticle], str]:
+        """
+        Returns the inline results for @bot [text] and the offset of the next batch, empty when there is none.
+        """
+        start = int(offset) if offset.isdigit() else 0
+        tgs, more = self._db.lookupTelegramGroups(query, start, limit)
+        results = []
+        for tg in tgs:
+            markup = telebot.types.InlineKeyboardMarkup()
+            markup.row(telebot.types.InlineKeyboardButton(f"Join {tg.unitCode}", url=tg.link))
+            results.append(telebot.types.InlineQueryResultArticle(
+                id=tg.unitCode,
+                title=f"{tg.unitCode} {tg.unitName}",
+                description=tg.link,
+                input_message_content=telebot.types.InputTextMessageContent(f"Click {tg.link} to join {tg.unitCode} {tg.unitName}"),
+                reply_markup=markup,
+            ))
+        return results, str(start + limit) if more else ""
+
+    async def subscribe(self, message:telebot.types.Message) -> List[str]:
+        tokens = message.text.split()
+        if len(tokens) < 2:
+            unitCodes = getReminderScheduler().subscriptions(message.chat.id)
+            if len(unitCodes) == 0:
+                return ["You are not subscribed to any unit. Try /subscribe [unit code]"]
+            return [f"You are subscribed to {', '.join(unitCodes)}."]
+        unitCode = tokens[1].upper()
+        try:
+            tg = await self._db.getTelegramGroup(unitCode)
+        except MalformedUnitCodeException:
+            return [f"Fail because {unitCode} is a malformed unit code."]
+        except NoTelegramGroupException:
+            return [f"Fail because no known telegram group for {unitCode}"]
+        if not await getReminderScheduler().subscribe(tg.unitCode, message.chat.id):
+            return [f"You are already subscribed to {tg.unitCode}."]
+        return [f"Success. You will be reminded of the deadlines of {tg.unitCode} {tg.unitName}."]
+
+    async def unsubscribe(self, message:telebot.types.Message) -> List[str]:
+        tokens = message.text.split()
+        if len(tokens) < 2:
+            return ["Fail because no unit code is given. Try /unsubscribe [unit code]"]
+        unitCode = tokens[1].upper()
+        if not await getReminderScheduler().unsubscribe(unitCode, message.chat.id):
+            return [f"Fail because you are not subscribed to {unitCode}."]
+        return [f"Success. You will no longer be reminded of the deadlines of {unitCode}."]
+
     def adminlist(self, message:telebot.types.Message) -> List[str]:
         admins = self._db.getAdmins()
         msg = f"The administrator is @{admins[0]}"
@@ -86,6 +201,18 @@ class User:
             "/get [unit code]",
             "Retrieve the telegram invitation link for the unit",
             "",
+            "/search [text]",
+            "Search telegram groups by unit code or unit name",
+            "",
+            "@bot [text]",
+            "Look up telegram groups from any chat",
+            "",
+            "/subscribe [unit code]",
+            "Get reminders of the deadlines of the unit, or list your subscriptions without a unit code",
+            "",
+            "/unsubscribe [unit code]",
+            "Stop the reminders of the deadlines of the unit",
+            "",
             "/admins",
             "Retrieve the list of administrators",
             "",
@@ -98,34 +225,49 @@ class User:
 class Admin(User):
     def __init__(self, username:str, fullname:str, logger:Logger):
         super().__init__(username, fullname, logger)
-        if username not in getDatabase().getAdmins():
+        if not self.isAdmin():
             raise NonAdminUserException(username, fullname)
 
+    def require(self, permission:str) -> None:
+        if not self._db.hasPermission(self._username, permission):
+            raise NonAdminUserException(self._username, self._fullname)
+
+    async def _audit(self, action:str, target:str, message:str) -> None:
+        await getAuditTrail().record(self._username, action, target, message)
+
     def help(self, message:telebot.types.Message) -> List[str]:
         commands = [
-            "/add [unit code] [link] [unit name]",
-            "Add the invitation link for given unit.",
-            "",
-            "/update [unit code] link [new link]", 
-            "Update the invitation link for the given unit.",
-            "",
-            "/update [unit code] name [new name]", 
-            "Update the unit name for the given unit.",
-            "",
-            "/rm [unit code]", 
-            "Remove the invitation link for the given unit.",
-            "",
+            (rbac.ADD, "/add [unit code] [link] [unit name]", "Add the invitation link for given unit."),
+            (rbac.UPDATE, "/update [unit code] link [new link]", "Update the invitation link for the given unit."),
+            (rbac.UPDATE, "/update [unit code] name [new name]", "Update the unit name for the given unit."),
+            (rbac.REMOVE, "/rm [unit code]", "Remove the invitation link for the given unit."),
+            (rbac.STATS, "/stats", "Display command, database and send latency statistics."),
+            (rbac.IMPORT, "/import", "Add telegram groups from an uploaded CSV or JSON document. Send the document with /import as its caption."),
+            (rbac.EXPORT, "/export", "Download all telegram groups as a CSV document."),
+            (rbac.REGISTER, "/register [unit code]", "Register the telegram group this is sent in as the group of the unit, so that it receives broadcasts."),
+            (rbac.BROADCAST, "/broadcast [all or unit code prefix] [message]", "Send a message to all registered telegram groups or to those of a unit code prefix."),
+            (rbac.REMIND, "/remind [unit code] [YYYY-MM-DD] [HH:MM] [deadline]", "Remind the subscribers of the unit of a deadline. The time is optional and defaults to 23:59."),
+            (rbac.HEALTH, "/health [check]", "Display the invite links found expired or revoked. With check, check all invite links first."),
+            (rbac.ROLES, "/grant [username] [role]", "Grant a role to a user. The roles are " + ", ".join(sorted(rbac.ROLE_PERMISSIONS)) + "."),
+            (rbac.ROLES, "/revoke [username] [role]", "Revoke a role from a user."),
+            (rbac.ROLES, "/roles [username]", "Display the roles of a user, or of all users with a role without a username."),
         ]
-        return ["\n".join(commands)]
+        permissions = self._db.getPermissions(self._username)
+        lines = []
+        for permission, command, description in commands:
+            if permission in permissions:
+                lines.extend([command, description, ""])
+        return ["\n".join(lines)]
         
 
-    def add(self, message:telebot.types.Message) -> List[str]:
+    @requires(rbac.ADD)
+    async def add(self, message:telebot.types.Message) -> List[str]:
         tokens = message.text.split()
         unitCode = tokens[1].upper()
         link = tokens[2]
         unitName = " ".join(tokens[3:])
         try:
-            self._db.addTelegramGroup(unitCode, unitName, link)
+            await self._db.addTelegramGroup(unitCode, unitName, link)
         except MalformedUnitCodeException:
             self._logger.error(f"{self._username} added a telegram group with a malformed unit code.")
             return [f"Fail because unit code {unitCode} is malformed."]
@@ -133,15 +275,17 @@ class Admin(User):
             self._logger.error(f"{self._username} added a telegram group with a bad telegram link.")
             return [f"Fail because bad telegram link {link} was given for {unitCode}"]
         else:
+            await self._audit("add", unitCode, f"{self._username} added {unitCode} {unitName} with link {link}")
             return [f"Success. {unitCode} {unitName} added"]
 
-    def update(self, message:telebot.types.Message) -> List[str]:
+    @requires(rbac.UPDATE)
+    async def update(self, message:telebot.types.Message) -> List[str]:
         tokens = message.text.split()
         if len(tokens) < 4:
             return [f"Fail because the update command has missing arguements."]
         unitCode = tokens[1].upper()
         try:
-            tg = self._db.getTelegramGroup(unitCode)
+            tg = await self._db.getTelegramGroup(unitCode)
         except MalformedUnitCodeException:
             self._logger.info(f"{self._username} attempted to update {unitCode} with malformed unit code.")
             return [f"Fail because {unitCode} is a malformed unit code."]
@@ -153,7 +297,7 @@ class Admin(User):
             if mode == "LINK":
                 link = tokens[3]
                 try:
-                    tg.updateLink(link)
+                    await self._db.updateLink(tg, link)
                 except NoTelegramGroupException:
                     self._logger.info(f"{self._username} attempted to update non-existent Telegram Group for {unitCode}")
                     return [f"Fail because no known telegram group for {unitCode}"]
@@ -161,12 +305,12 @@ class Admin(User):
                     self._logger.info(f"{self._username} attempted to update telegram group for {unitCode} with bad link {link}")
                     return [f"Fail because {link} is a bad link."]
                 else:
-                    self._logger.info(f"{self._username} updated telegram link for {unitCode} with link {link}")
+                    await self._audit("update", unitCode, f"{self._username} updated telegram link for {unitCode} with link {link}")
                     return [f"Success. Telegram link for {unitCode} has been updated."]
             elif mode == "NAME":
                 name = tokens[3]
                 try:
-                    tg.updateUnitName(name)
+                    await self._db.updateUnitName(tg, name)
                 except NoTelegramGroupException:
                     self._logger.info(f"{self._username} attempted to update non-existent Telegram Group for {unitCode}")
                     return [f"Fail because no known telegram group for {unitCode}"]
@@ -174,22 +318,198 @@ class Admin(User):
                     self._logger.info(f"{self._username} attempted to update telegram group for {unitCode} with bad unit name.")
                     return [f"Fail because bad unit name is provided."]
                 else:
-                    self._logger.info(f"{self._username} updated unit name for {unitCode} with unit name {name}")
+                    await self._audit("update", unitCode, f"{self._username} updated unit name for {unitCode} with unit name {name}")
                     return [f"Success. Unit name for {unitCode} has been updated."]
             else:
                 self._logger.info(f"{self._username} attempted to update unknown attribute for telegram gorup {unitCode}")
                 return [f"Fail because update mode is neither link nor name."]
 
-    def remove(self, message:telebot.types.Message) -> List[str]:
+    @requires(rbac.REMOVE)
+    async def remove(self, message:telebot.types.Message) -> List[str]:
         tokens = message.text.split()
         unitCode = tokens[1].upper()
         try:
-            tg = self._db.getTelegramGroup(unitCode)
+            tg = await self._db.getTelegramGroup(unitCode)
         except NoTelegramGroupException:
             self._logger.info(f"{self._username} attempted to remove non existent Telegram Group for {unitCode}")
             return [f"Fail because no known Telegram Group for {unitCode}"]
         except MalformedUnitCodeException:
             return [f"Fail because {unitCode} is a malformed unit code."]
         else:
-            tg.delete()
+            await self._db.deleteTelegramGroup(tg)
+            await self._audit("rm", unitCode, f"{self._username} removed the telegram group for {unitCode}")
             return [f"Success. Telegram group for {unitCode} is deleted."]
+
+    @requires(rbac.STATS)
+    def stats(self, message:telebot.types.Message) -> List[str]:
+        lines = getMetrics().summary()
+        if len(lines) == 0:
+            return ["No statistics available."]
+        return ["\n".join(lines)]
+
+    @requires(rbac.IMPORT)
+    async def importGroups(self, message:telebot.types.Message, filename:str, data:bytes, batchSize:int=500, maxErrors:int=100) -> List[str]:
+        imported = 0
+        errors = []
+        batch = []
+        try:
+            for number, row in readGroups(filename, data):
+                if isinstance(row, Exception):
+                    errors.append(f"row {number}: {row}")
+                    continue
+                _, unitCode, unitName, link = row
+                try:
+                    validateTelegramGroup(unitCode, unitName, link)
+                except (MalformedUnitCodeException, BadTelegramLinkException, BadUnitNameException) as e:
+                    errors.append(f"row {number}: {e}")
+                    continue
+                batch.append((unitCode, unitName, link))
+                if len(batch) >= batchSize:
+                    imported += await self._db.addTelegramGroups(batch)
+                    batch = []
+            if len(batch) > 0:
+                imported += await self._db.addTelegramGroups(batch)
+        except UnsupportedFormatException as e:
+            self._logger.info(f"{self._username} attempted to import {filename} in an unsupported format.")
+            return [f"Fail because {e}."]
+        except UnicodeDecodeError:
+            self._logger.info(f"{self._username} attempted to import {filename} which is not UTF-8 text.")
+            return [f"Fail because {filename} is not UTF-8 text."]
+        await self._audit("import", filename, f"{self._username} imported {imported} telegram groups from {filename} with {len(errors)} bad rows.")
+        lines = [f"Success. {imported} telegram groups imported from {filename}."]
+        if len(errors) > 0:
+            lines.append(f"{len(errors)} rows were skipped:")
+            lines.extend(errors[:maxErrors])
+            if len(errors) > maxErrors:
+                lines.append(f"and {len(errors) - maxErrors} more.")
+        return ["\n".join(lines)]
+
+    @requires(rbac.EXPORT)
+    async def exportGroups(self, message:telebot.types.Message) -> bytes:
+        data = writeGroups(self._db.iterGroups())
+        self._logger.info(f"{self._username} exported the telegram groups.")
+        return data
+
+    @requires(rbac.REGISTER)
+    async def register(self, message:telebot.types.Message) -> List[str]:
+        if message.chat.type == "private":
+            return ["Fail because /register must be sent in the telegram group of the unit."]
+        tokens = message.text.split()
+        if len(tokens) < 2:
+            return ["Fail because no unit code is given. Try /register [unit code]"]
+        unitCode = tokens[1].upper()
+        try:
+            tg = await self._db.registerChat(unitCode, message.chat.id)
+        except MalformedUnitCodeException:
+            return [f"Fail because {unitCode} is a malformed unit code."]
+        except NoTelegramGroupException:
+            return [f"Fail because no known telegram group for {unitCode}"]
+        else:
+            await self._audit("register", unitCode, f"{self._username} registered chat {message.chat.id} for {unitCode}")
+            return [f"Success. This chat is registered as the telegram group for {tg.unitCode} {tg.unitName}."]
+
+    @requires(rbac.BROADCAST)
+    async def broadcast(self, message:telebot.types.Message) -> List[str]:
+        tokens = message.text.split(maxsplit=2)
+        if len(tokens) < 3:
+            return ["Fail because the broadcast command has missing arguments. Try /broadcast [all or unit code prefix] [message]"]
+        scope = tokens[1].upper()
+        prefix = None
+        if scope != "ALL":
+            if len(scope) != 3 or not scope.isalpha():
+                return [f"Fail because {tokens[1]} is neither all nor a unit code prefix."]
+            prefix = scope
+        targets = await self._db.getChats(prefix)
+        if len(targets) == 0:
+            return ["Fail because no telegram groups are registered for the broadcast. Send /register [unit code] in a telegram group first."]
+        broadcastId = await getBroadcaster().start(message.chat.id, tokens[2], targets)
+        await self._audit("broadcast", scope, f"{self._username} started broadcast {broadcastId} to {len(targets)} telegram groups")
+        return [f"Broadcasting to {len(targets)} telegram groups as broadcast {broadcastId}. A summary follows when it is done."]
+
+    @requires(rbac.REMIND)
+    async def remind(self, message:telebot.types.Message) -> List[str]:
+        tokens = message.text.split(maxsplit=3)
+        if len(tokens) < 4:
+            return ["Fail because the remind command has missing arguments. Try /remind [unit code] [YYYY-MM-DD] [HH:MM] [deadline]"]
+        unitCode = tokens[1].upper()
+        day = tokens[2]
+        clock = "23:59"
+        text = tokens[3]
+        parts = text.split(maxsplit=1)
+        if re.fullmatch(r"\d{1,2}:\d{2}", parts[0]):
+            if len(parts) < 2:
+                return ["Fail because no deadline is given."]
+            clock, text = parts
+        try:
+            due = datetime.strptime(f"{day} {clock}", "%Y-%m-%d %H:%M").timestamp()
+        except ValueError:
+            return [f"Fail because {day} {clock} is not a date in the form YYYY-MM-DD HH:MM."]
+        if due <= time.time():
+            return [f"Fail because {day} {clock} has passed."]
+        try:
+            tg = await self._db.getTelegramGroup(unitCode)
+        except MalformedUnitCodeException:
+            return [f"Fail because {unitCode} is a malformed unit code."]
+        except NoTelegramGroupException:
+            return [f"Fail because no known telegram group for {unitCode}"]
+        at = await getReminderScheduler().remind(tg.unitCode, due, text)
+        await self._audit("remind", unitCode, f"{self._username} added a reminder for {unitCode} due {day} {clock}")
+        return [f"Success. Subscribers of {tg.unitCode} will be reminded on {time.strftime('%Y-%m-%d %H:%M', time.localtime(at))}."]
+
+    @requires(rbac.HEALTH)
+    async def health(self, message:telebot.types.Message) -> List[str]:
+        tokens = message.text.split()
+        checker = getLinkChecker()
+        if len(tokens) > 1:
+            if tokens[1].upper() != "CHECK":
+                return ["Fail because the health command only takes check. Try /health [check]"]
+            self._logger.info(f"{self._username} started a check of all invite links")
+            checker.sweepAndReport(message.chat.id)
+            return ["Checking all invite links. The report follows when the check is done."]
+        return ["\n".join(checker.report())]
+
+    @requires(rbac.ROLES)
+    async def grant(self, message:telebot.types.Message) -> List[str]:
+        tokens = message.text.split()
+        if len(tokens) < 3:
+            return ["Fail because the grant command has missing arguments. Try /grant [username] [role]"]
+        username = rbac.normaliseUsername(tokens[1])
+        if username == "":
+            return [f"Fail because {tokens[1]} is not a username. Try /grant [username] [role]"]
+        role = tokens[2].lower()
+        try:
+            granted = await self._db.grantRole(username, role)
+        except rbac.UnknownRoleException as e:
+            return [f"Fail because {e}."]
+        if not granted:
+            return [f"@{username} already holds the {role} role."]
+        await self._audit("grant", username, f"{self._username} granted the {role} role to {username}")
+        return [f"Success. @{username} holds the {role} role."]
+
+    @requires(rbac.ROLES)
+    async def revoke(self, message:telebot.types.Message) -> List[str]:
+        tokens = message.text.split()
+        if len(tokens) < 3:
+            return ["Fail because the revoke command has missing arguments. Try /revoke [username] [role]"]
+        username = rbac.normaliseUsername(tokens[1])
+        if username == "":
+            return [f"Fail because {tokens[1]} is not a username. Try /revoke [username] [role]"]
+        role = tokens[2].lower()
+        if role == rbac.ADMIN and self._db.isConfigAdmin(username):
+            return [f"Fail because @{username} is an administrator in the config. Remove @{username} from ADMINS to revoke the admin role."]
+        if not await self._db.revokeRole(username, role):
+            return [f"Fail because @{username} was not granted the {role} role."]
+        await self._audit("revoke", username, f"{self._username} revoked the {role} role from {username}")
+        return [f"Success. @{username} no longer holds the {role} role."]
+
+    @requires(rbac.ROLES)
+    def roles(self, message:telebot.types.Message) -> List[str]:
+        tokens = message.text.split()
+        if len(tokens) > 1:
+            username = rbac.normaliseUsername(tokens[1])
+            roles = self._db.getRoles(username)
+            if len(roles) == 0:
+                return [f"@{username} holds no roles."]
+            return [f"@{username} holds {', '.join(roles)}."]
+        lines = [f"@{username}: {', '.join(roles)}" for username, roles in self._db.getRoleHolders().items()]
+        return ["\n".join(lines)]
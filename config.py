@@ -1,21 +1,217 @@
-from typing import List, Tuple
+from typing import Dict, List, NamedTuple, Optional
 from dotenv import dotenv_values
 
 class ConfigException(Exception):
     pass
 
-def readConfig() -> Tuple[str, List[str], str]:
-    config = dotenv_values(".env")
+class Config(NamedTuple):
+    token: str
+    admins: List[str]
+    database: str = "database.db"
+    backend: str = "shelve"
+    readers: int = 4
+    mode: str = "polling"
+    webhookUrl: Optional[str] = None
+    webhookHost: str = "0.0.0.0"
+    webhookPort: int = 8443
+    webhookSecret: Optional[str] = None
+    webhookConcurrency: int = 32
+    sendGlobalRate: float = 30
+    sendChatRate: float = 1
+    sendChatBurst: float = 3
+    sendWorkers: int = 4
+    metricsHost: str = "127.0.0.1"
+    metricsPort: Optional[int] = None
+    getAll: str = "pages"
+    inlineCacheTime: int = 300
+    broadcastWorkers: int = 8
+    reminderLead: float = 24
+    linkCheckUrl: str = "https://t.me/"
+    linkCheckInterval: float = 6
+    linkCheckTtl: float = 24
+    linkCheckConcurrency: int = 4
+    linkCheckHostDelay: float = 1.0
+    floodLimit: int = 20
+    floodCommandLimits: Dict[str, int] = {"get_all": 5, "export": 2, "import": 2}
+    floodWindow: float = 60
+    floodInteractiveLimit: int = 120
+    journal: bool = True
+    journalCheckpoint: int = 1000
+    shutdownTimeout: float = 30
+    logFormat: str = "json"
+    opsChatId: Optional[int] = None
+    opsDigestInterval: float = 60
+    auditRetention: float = 90
+    workers: int = 1
+
+def parseLimits(text:str) -> Dict[str, int]:
+    limits = {}
+    for item in text.split(","):
+        if item.strip() == "":
+            continue
+        command, _, limit = item.partition("=")
+        try:
+            limits[command.strip().lower()] = int(limit)
+        except ValueError:
+            raise ConfigException(f"Bad limit {item} in FLOOD_COMMAND_LIMITS, expected command=limit")
+    return limits
+
+ENV_FILE = ".env"
+
+def readConfig(path:str=ENV_FILE) -> Config:
+    config = dotenv_values(path)
     try:
         token = config["TOKEN"]
     except KeyError:
         raise ConfigException("Missing API Token")
     try:
-        admins = config["ADMINS"].split(",")
+        # blank entries, e.g. from a trailing comma, would match every user without a username
+        admins = [admin.strip() for admin in config["ADMINS"].split(",") if admin.strip() != ""]
     except KeyError:
         raise ConfigException("Missing Admins List")
+    if not admins:
+        raise ConfigException("Empty Admins List, ADMINS needs at least one username")
     try:
         database = config["DATABASE"]
     except KeyError:
         database = "database.db"
-    return token, admins, database
+    backend = config.get("BACKEND", "shelve").lower()
+    if backend not in ("shelve", "sqlite"):
+        raise ConfigException(f"Unknown storage backend {backend}")
+    try:
+        readers = int(config.get("DB_READERS", 4))
+    except ValueError:
+        raise ConfigException("DB_READERS must be an integer")
+    mode = config.get("MODE", "polling").lower()
+    if mode not in ("polling", "webhook"):
+        raise ConfigException(f"Unknown mode {mode}")
+    webhookUrl = config.get("WEBHOOK_URL")
+    webhookSecret = config.get("WEBHOOK_SECRET")
+    if mode == "webhook":
+        if not webhookUrl:
+            raise ConfigException("Missing webhook URL")
+        if not webhookSecret:
+            raise ConfigException("Missing webhook secret token")
+    webhookHost = config.get("WEBHOOK_HOST", "0.0.0.0")
+    try:
+        webhookPort = int(config.get("WEBHOOK_PORT", 8443))
+        webhookConcurrency = int(config.get("WEBHOOK_CONCURRENCY", 32))
+    except ValueError:
+        raise ConfigException("WEBHOOK_PORT and WEBHOOK_CONCURRENCY must be integers")
+    try:
+        sendGlobalRate = float(config.get("SEND_GLOBAL_RATE", 30))
+        sendChatRate = float(config.get("SEND_CHAT_RATE", 1))
+        sendChatBurst = float(config.get("SEND_CHAT_BURST", 3))
+        sendWorkers = int(config.get("SEND_WORKERS", 4))
+    except ValueError:
+        raise ConfigException("SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST and SEND_WORKERS must be numbers")
+    metricsHost = config.get("METRICS_HOST", "127.0.0.1")
+    try:
+        metricsPort = int(config["METRICS_PORT"]) if config.get("METRICS_PORT") else None
+    except ValueError:
+        raise ConfigException("METRICS_PORT must be an integer")
+    getAll = config.get("GET_ALL", "pages").lower()
+    if getAll not in ("pages", "messages"):
+        raise ConfigException(f"Unknown GET_ALL mode {getAll}")
+    try:
+        inlineCacheTime = int(config.get("INLINE_CACHE_TIME", 300))
+    except ValueError:
+        raise ConfigException("INLINE_CACHE_TIME must be an integer")
+    try:
+        broadcastWorkers = int(config.get("BROADCAST_WORKERS", 8))
+    except ValueError:
+        raise ConfigException("BROADCAST_WORKERS must be an integer")
+    try:
+        reminderLead = float(config.get("REMINDER_LEAD", 24))
+    except ValueError:
+        raise ConfigException("REMINDER_LEAD must be a number")
+    linkCheckUrl = config.get("LINK_CHECK_URL", "https://t.me/")
+    try:
+        linkCheckInterval = float(config.get("LINK_CHECK_INTERVAL", 6))
+        linkCheckTtl = float(config.get("LINK_CHECK_TTL", 24))
+        linkCheckConcurrency = int(config.get("LINK_CHECK_CONCURRENCY", 4))
+        linkCheckHostDelay = float(config.get("LINK_CHECK_HOST_DELAY", 1.0))
+    except ValueError:
+        raise ConfigException("LINK_CHECK_INTERVAL, LINK_CHECK_TTL, LINK_CHECK_CONCURRENCY and LINK_CHECK_HOST_DELAY must be numbers")
+    try:
+        floodLimit = int(config.get("FLOOD_LIMIT", 20))
+        floodWindow = float(config.get("FLOOD_WINDOW", 60))
+        floodInteractiveLimit = int(config.get("FLOOD_INTERACTIVE_LIMIT", 120))
+    except ValueError:
+        raise ConfigException("FLOOD_LIMIT, FLOOD_WINDOW and FLOOD_INTERACTIVE_LIMIT must be numbers")
+    floodCommandLimits = parseLimits(config.get("FLOOD_COMMAND_LIMITS", "get_all=5,export=2,import=2"))
+    journal = config.get("JOURNAL", "on").lower()
+    if journal not in ("on", "off"):
+        raise ConfigException(f"Unknown JOURNAL setting {journal}, expected on or off")
+    try:
+        journalCheckpoint = int(config.get("JOURNAL_CHECKPOINT", 1000))
+    except ValueError:
+        raise ConfigException("JOURNAL_CHECKPOINT must be an integer")
+    try:
+        shutdownTimeout = float(config.get("SHUTDOWN_TIMEOUT", 30))
+    except ValueError:
+        raise ConfigException("SHUTDOWN_TIMEOUT must be a number")
+    logFormat = config.get("LOG_FORMAT", "json").lower()
+    if logFormat not in ("json", "text"):
+        raise ConfigException(f"Unknown LOG_FORMAT {logFormat}, expected json or text")
+    try:
+        opsChatId = int(config["OPS_CHAT_ID"]) if config.get("OPS_CHAT_ID") else None
+    except ValueError:
+        raise ConfigException("OPS_CHAT_ID must be an integer")
+    try:
+        opsDigestInterval = float(config.get("OPS_DIGEST_INTERVAL", 60))
+        auditRetention = float(config.get("AUDIT_RETENTION", 90))
+    except ValueError:
+        raise ConfigException("OPS_DIGEST_INTERVAL and AUDIT_RETENTION must be numbers")
+    try:
+        workers = int(config.get("WORKERS", 1))
+    except ValueError:
+        raise ConfigException("WORKERS must be an integer")
+    if workers < 1:
+        raise ConfigException("WORKERS must be at least 1")
+    if workers > 1:
+        # the workers share the database, which only SQLite allows, and the updates are fetched by polling
+        if backend != "sqlite":
+            raise ConfigException("WORKERS above 1 needs BACKEND=sqlite")
+        if mode != "polling":
+            raise ConfigException("WORKERS above 1 needs MODE=polling")
+    return Config(
+        token=token,
+        admins=admins,
+        database=database,
+        backend=backend,
+        readers=readers,
+        mode=mode,
+        webhookUrl=webhookUrl,
+        webhookHost=webhookHost,
+        webhookPort=webhookPort,
+        webhookSecret=webhookSecret,
+        webhookConcurrency=webhookConcurrency,
+        sendGlobalRate=sendGlobalRate,
+        sendChatRate=sendChatRate,
+        sendChatBurst=sendChatBurst,
+        sendWorkers=sendWorkers,
+        metricsHost=metricsHost,
+        metricsPort=metricsPort,
+        getAll=getAll,
+        inlineCacheTime=inlineCacheTime,
+        broadcastWorkers=broadcastWorkers,
+        reminderLead=reminderLead,
+        linkCheckUrl=linkCheckUrl,
+        linkCheckInterval=linkCheckInterval,
+        linkCheckTtl=linkCheckTtl,
+        linkCheckConcurrency=linkCheckConcurrency,
+        linkCheckHostDelay=linkCheckHostDelay,
+        floodLimit=floodLimit,
+        floodCommandLimits=floodCommandLimits,
+        floodWindow=floodWindow,
+        floodInteractiveLimit=floodInteractiveLimit,
+        journal=journal == "on",
+        journalCheckpoint=journalCheckpoint,
+        shutdownTimeout=shutdownTimeout,
+        logFormat=logFormat,
+        opsChatId=opsChatId,
+        opsDigestInterval=opsDigestInterval,
+        auditRetention=auditRetention,
+        workers=workers,
+    )
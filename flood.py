@@ -0,0 +1,166 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from logging import Logger
+
+import math
+import time
+
+import telebot
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_handler_backends import BaseMiddleware, CancelUpdate
+
+from metrics import getMetrics
+
+_METRICS = getMetrics()
+
+class _Window:
+    __slots__ = ("slot", "previous", "current", "noticed")
+
+    def __init__(self, slot:int) -> None:
+        self.slot = slot
+        self.previous = 0
+        self.current = 0
+        self.noticed = False
+
+class SlidingWindowLimiter:
+    """
+    Counts events per key over a sliding window of window seconds.
+    The sliding count is estimated from the counts of the current and the previous fixed window,
+    so every key costs a few integers however many events it sees. At most maxKeys keys are kept
+    and the least recently used key is evicted first. The time is read from clock.
+    """
+    def __init__(self, window:float=60, maxKeys:int=100000, clock:Callable[[], float]=time.time) -> None:
+        self._window = window
+        self._maxKeys = maxKeys
+        self._clock = clock
+        self._windows: "OrderedDict[Tuple[int, str], _Window]" = OrderedDict()
+
+    def _get(self, key:Tuple[int, str], slot:int) -> _Window:
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = _Window(slot)
+            if len(self._windows) > self._maxKeys:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(key)
+        if window.slot != slot:
+            window.previous = window.current if window.slot == slot - 1 else 0
+            window.current = 0
+            window.slot = slot
+        return window
+
+    def _wait(self, window:_Window, limit:int, elapsed:float) -> float:
+        weight = 1 - elapsed / self._window
+        if window.previous * weight + window.current + 1 <= limit:
+            return 0.0
+        if window.current + 1 <= limit and window.previous > 0:
+            # the previous window has to fade until the event fits
+            wait = (1 - (limit - 1 - window.current) / window.previous) * self._window - elapsed
+        else:
+            # the event fits only in the next window, once the count of this one, weighted as the previous, has faded
+            fade = 1 - (limit - 1) / window.current if window.current > 0 else 0
+            wait = self._window - elapsed + min(max(fade, 0), 1) * self._window
+        return max(wait, 0.001)
+
+    def hit(self, checks:List[Tuple[Tuple[int, str], int]]) -> Tuple[float, bool]:
+        """
+        Counts an event for every (key, limit) in checks and returns (0, False) when each key is within its limit.
+        Otherwise the event is counted for none of them and returns the seconds until the first key over
+        its limit is allowed again, and whether this is the first event refused since the last one allowed.
+        """
+        now = self._clock()
+        slot = int(now // self._window)
+        elapsed = now - slot * self._window
+        windows = []
+        for key, limit in checks:
+            window = self._get(key, slot)
+            wait = self._wait(window, limit, elapsed)
+            if wait > 0:
+                first = not window.noticed
+                window.noticed = True
+                return wait, first
+            windows.append(window)
+        for window in windows:
+            window.current += 1
+            window.noticed = False
+        return 0.0, False
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+def commandOf(update) -> Optional[str]:
+    """
+    Returns the command an update invokes, "get_all" for /get all, or None when it is not a command.
+    """
+    if isinstance(update, telebot.types.CallbackQuery):
+        return "browse"
+    if isinstance(update, telebot.types.InlineQuery):
+        return "inline"
+    text = update.text or update.caption or ""
+    if not text.startswith("/"):
+        return None
+    tokens = text.split()
+    command = tokens[0][1:].split("@")[0].lower()
+    if command == "get" and len(tokens) > 1 and tokens[1].upper() == "ALL":
+        return "get_all"
+    return command
+
+# inline queries arrive once per keystroke and page buttons are pressed in quick succession,
+# so they are counted against a budget of their own rather than the limit across all commands
+INTERACTIVE = ("inline", "browse")
+
+class FloodMiddleware(BaseMiddleware):
+    """
+    Refuses the commands of a user beyond limit per window across all commands, or beyond the
+    limit of the command in commandLimits. Inline queries and page buttons are limited by
+    interactiveLimit instead of limit. A refused user gets a single cooldown notice and
+    further updates are dropped until the user is allowed again. Exempt users are never limited.
+    """
+    def __init__(self, bot:AsyncTeleBot, reply:Callable, logger:Logger, limit:int=20, commandLimits:Optional[Dict[str, int]]=None,
+                 window:float=60, isExempt:Callable[[str], bool]=lambda username: False, interactiveLimit:int=120) -> None:
+        super().__init__()
+        self.update_types = ["message", "callback_query", "inline_query"]
+        self._bot = bot
+        self._reply = reply
+        self._logger = logger
+        self._limit = limit
+        self._interactiveLimit = interactiveLimit
+        self._commandLimits = commandLimits or {}
+        self._isExempt = isExempt
+        self._limiter = SlidingWindowLimiter(window)
+        _METRICS.gauge("bot_flood_tracked", lambda: len(self._limiter), "user and command pairs tracked by flood protection")
+
+    def _check(self, userId:int, command:str) -> Tuple[float, bool]:
+        checks: List[Tuple[Tuple[int, str], int]] = []
+        if command in self._commandLimits:
+            checks.append(((userId, command), self._commandLimits[command]))
+        if command in INTERACTIVE:
+            if self._interactiveLimit > 0:
+                checks.append(((userId, "~"), self._interactiveLimit))
+        elif self._limit > 0:
+            checks.append(((userId, "*"), self._limit))
+        if not checks:
+            return 0.0, False
+        return self._limiter.hit(checks)
+
+    async def pre_process(self, update, data) -> Optional[CancelUpdate]:
+        user = update.from_user
+        command = commandOf(update)
+        if user is None or command is None or self._isExempt(user.username):
+            return None
+        wait, first = self._check(user.id, command)
+        if wait == 0:
+            return None
+        _METRICS.inc("bot_flood_refused_total", help="updates refused by flood protection", command=command)
+        notice = f"Slow down. You can use the bot again in {math.ceil(wait)} seconds."
+        if first:
+            self._logger.info(f"{user.username} is refused {command} for {math.ceil(wait)}s by flood protection")
+        if isinstance(update, telebot.types.CallbackQuery):
+            # the button spins until the callback is answered
+            await self._bot.answer_callback_query(update.id, notice if first else None)
+        elif isinstance(update, telebot.types.Message) and first:
+            await self._reply(update, [notice])
+        return CancelUpdate()
+
+    async def post_process(self, update, data, exception) -> None:
+        pass
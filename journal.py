@@ -0,0 +1,189 @@
+from typing import Any, Iterable, Iterator, List, Tuple
+
+import os
+import json
+import zlib
+import threading
+
+from storage import StorageBackend
+from metrics import getMetrics
+
+_METRICS = getMetrics()
+
+# the journal of a database is kept beside it
+JOURNAL_SUFFIX = ".journal"
+
+class Journal:
+    """
+    Append-only file of the mutations of a store, one record per line, each line a CRC-32 checksum
+    followed by the record as JSON. Appends are only buffered. commit() makes every record appended
+    since the last commit durable with a single fsync, so writes that arrive together share its cost.
+    """
+    def __init__(self, path:str) -> None:
+        self._path = path
+        self._file = open(path, "ab")
+        # records in the file, including those not committed yet
+        self._records = 0
+        self._uncommitted = 0
+
+    @staticmethod
+    def read(path:str) -> Iterator[List[Any]]:
+        """
+        Yields the records in the journal at path up to the first torn or corrupt line,
+        which is where a crash interrupted the last append.
+        """
+        try:
+            journal = open(path, "rb")
+        except FileNotFoundError:
+            return
+        with journal:
+            for line in journal:
+                if not line.endswith(b"\n"):
+                    return
+                checksum, _, payload = line.rstrip(b"\n").partition(b" ")
+                try:
+                    if int(checksum, 16) != zlib.crc32(payload):
+                        return
+                    record = json.loads(payload)
+                except ValueError:
+                    return
+                yield record
+
+    def append(self, record:List[Any]) -> None:
+        payload = json.dumps(record, separators=(",", ":")).encode()
+        self._file.write(b"%08x %s\n" % (zlib.crc32(payload), payload))
+        self._records += 1
+        self._uncommitted += 1
+
+    def commit(self) -> int:
+        """
+        Flushes and fsyncs the records appended so far and returns the number of records in the journal.
+        """
+        if self._uncommitted > 0:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            _METRICS.inc("bot_journal_commits_total", help="fsyncs of the journal")
+            _METRICS.inc("bot_journal_records_total", self._uncommitted, help="mutations written to the journal")
+            self._uncommitted = 0
+        return self._records
+
+    def truncate(self) -> None:
+        self._file.truncate(0)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._records = 0
+        self._uncommitted = 0
+
+    def close(self) -> None:
+        self._file.close()
+
+class JournaledBackend(StorageBackend):
+    """
+    Writes every mutation to a journal before it is applied to the wrapped backend, so a write is
+    durable once the journal is synced rather than when the backend flushes its own files.
+    Every checkpoint records the backend is synced, which makes its files the snapshot, and the
+    journal is truncated so that a restart only has to replay the records written since.
+    """
+    def __init__(self, backend:StorageBackend, path:str, checkpoint:int=1000) -> None:
+        self._backend = backend
+        self._checkpoint = checkpoint
+        # keeps the order of the journal the order in which the backend applies the writes
+        self._lock = threading.RLock()
+        self.replayed = self._replay(path)
+        self._journal = Journal(path)
+        # a torn record left at the end would hide every record appended after it
+        if os.path.getsize(path) > 0:
+            self._backend.sync()
+            self._journal.truncate()
+
+    def _replay(self, path:str) -> int:
+        count = 0
+        rows: List[Tuple[str, str, str]] = []
+        for record in Journal.read(path):
+            count += 1
+            operation = record[0]
+            # runs of puts are applied in one batch, which SQLite commits at once
+            if operation == "put":
+                rows.append(tuple(record[1:]))
+                continue
+            if operation == "putMany":
+                rows.extend(tuple(row) for row in record[1])
+                continue
+            if rows:
+                self._backend.putMany(rows)
+                rows = []
+            try:
+                if operation == "delete":
+                    self._backend.delete(record[1])
+                elif operation == "putValue":
+                    self._backend.putValue(record[1], record[2], record[3])
+                elif operation == "deleteValue":
+                    self._backend.deleteValue(record[1], record[2])
+            except KeyError:
+                # the key was already gone when the delete was journaled, or the backend had applied it
+                pass
+        if rows:
+            self._backend.putMany(rows)
+        return count
+
+    def get(self, unitCode:str) -> Tuple[str, str]:
+        return self._backend.get(unitCode)
+
+    def put(self, unitCode:str, unitName:str, link:str) -> None:
+        with self._lock:
+            self._journal.append(["put", unitCode, unitName, link])
+            self._backend.put(unitCode, unitName, link)
+
+    def putMany(self, rows:Iterable[Tuple[str, str, str]]) -> int:
+        rows = list(rows)
+        with self._lock:
+            self._journal.append(["putMany", rows])
+            return self._backend.putMany(rows)
+
+    def delete(self, unitCode:str) -> None:
+        with self._lock:
+            self._journal.append(["delete", unitCode])
+            self._backend.delete(unitCode)
+
+    def items(self) -> Iterator[Tuple[str, str, str]]:
+        return self._backend.items()
+
+    def __contains__(self, unitCode:str) -> bool:
+        return unitCode in self._backend
+
+    def getValue(self, namespace:str, key:str) -> Any:
+        return self._backend.getValue(namespace, key)
+
+    def putValue(self, namespace:str, key:str, value:Any) -> None:
+        with self._lock:
+            self._journal.append(["putValue", namespace, key, value])
+            self._backend.putValue(namespace, key, value)
+
+    def deleteValue(self, namespace:str, key:str) -> None:
+        with self._lock:
+            self._journal.append(["deleteValue", namespace, key])
+            self._backend.deleteValue(namespace, key)
+
+    def values(self, namespace:str) -> Iterator[Tuple[str, Any]]:
+        return self._backend.values(namespace)
+
+    def namespaces(self) -> List[str]:
+        return self._backend.namespaces()
+
+    def sync(self) -> None:
+        with self._lock:
+            if self._journal.commit() >= self._checkpoint > 0:
+                self.checkpoint()
+
+    def checkpoint(self) -> None:
+        with self._lock:
+            self._journal.commit()
+            self._backend.sync()
+            self._journal.truncate()
+            _METRICS.inc("bot_journal_checkpoints_total", help="snapshots of the store that truncated the journal")
+
+    def close(self) -> None:
+        with self._lock:
+            self.checkpoint()
+            self._journal.close()
+            self._backend.close()
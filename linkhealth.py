@@ -0,0 +1,265 @@
+from typing import Dict, List, NamedTuple, Optional, Set
+from logging import Logger
+from urllib.parse import urlparse
+
+import time
+import random
+import asyncio
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, ClientError
+
+from persistence import getDatabase, getAsyncDatabase, GroupRecord
+from metrics import getMetrics
+from broadcast import Send
+
+_METRICS = getMetrics()
+
+_CHECKER: "LinkChecker" = None
+
+TELEGRAM_LINK = "https://t.me/"
+# the invite page of a group names the group, an expired or revoked invite does not
+VALID_MARKER = "tgme_page_title"
+# namespace of the last result of each invite link, keyed by unit code
+LINK_HEALTH = "linkhealth"
+
+def setup(send:Send, logger:Logger, endpoint:str=TELEGRAM_LINK, interval:float=6 * 3600, ttl:float=24 * 3600,
+          concurrency:int=4, hostDelay:float=1.0) -> None:
+    global _CHECKER
+    _CHECKER = LinkChecker(send, logger, endpoint, interval, ttl, concurrency, hostDelay)
+
+class LinkCheckerNotReadyException(Exception):
+    pass
+
+def getLinkChecker() -> "LinkChecker":
+    global _CHECKER
+    if _CHECKER is None:
+        raise LinkCheckerNotReadyException()
+    return _CHECKER
+
+class LinkStatus(NamedTuple):
+    link: str
+    # None when the link could not be checked
+    healthy: Optional[bool]
+    checked: float
+    detail: str
+
+class LinkChecker:
+    """
+    Checks the invite links of all telegram groups in the background every interval seconds.
+    At most concurrency requests are in flight over one pooled HTTP session, requests to the
+    same host are at least hostDelay seconds apart, and throttled or failed requests are retried
+    with exponential back-off. Results are kept in the database and reused for ttl seconds unless
+    the link changes, also after a restart.
+    """
+    MAX_RETRIES = 3
+    BACKOFF = 2.0
+    TIMEOUT = 10.0
+
+    def __init__(self, send:Send, logger:Logger, endpoint:str=TELEGRAM_LINK, interval:float=6 * 3600, ttl:float=24 * 3600,
+                 concurrency:int=4, hostDelay:float=1.0) -> None:
+        self._send = send
+        self._logger = logger
+        self._endpoint = endpoint if endpoint.endswith("/") else endpoint + "/"
+        self._interval = interval
+        self._ttl = ttl
+        self._concurrency = concurrency
+        self._hostDelay = hostDelay
+        self._results: Dict[str, LinkStatus] = {}
+        self._nextRequest: Dict[str, float] = {}
+        self._session: ClientSession = None
+        self._task: asyncio.Task = None
+        self._sweep: asyncio.Task = None
+        # whether the last sweep started or queued checks every link
+        self._sweepForced = False
+        self._reports: Set[asyncio.Task] = set()
+        self._lastSweep = 0.0
+        _METRICS.gauge("bot_links_unhealthy", lambda: sum(1 for status in self._results.values() if status.healthy is False),
+                       "invite links found expired or revoked")
+
+    async def start(self, periodic:bool=True) -> None:
+        """
+        Loads the results kept in the database and starts the periodic checks, unless interval is 0
+        or periodic is False, when another process sharing the database runs them.
+        """
+        for unitCode, status in await getAsyncDatabase().getValues(LINK_HEALTH):
+            self.record(unitCode, LinkStatus(*status))
+        if periodic and self._interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._sweep, *self._reports):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = None
+        self._sweep = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _getSession(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            connector = TCPConnector(limit=self._concurrency)
+            self._session = ClientSession(connector=connector, timeout=ClientTimeout(total=self.TIMEOUT))
+        return self._session
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                self._logger.error(f"link check failed: {e}")
+            await asyncio.sleep(self._interval)
+
+    async def sweep(self, force:bool=False) -> Dict[str, int]:
+        """
+        Checks every invite link without a fresh result, or every link when force is set.
+        Concurrent callers share the sweep in progress, unless it skips fresh links and force is set,
+        in which case a sweep of every link is queued after it.
+        """
+        if self._sweep is None or self._sweep.done():
+            self._sweepForced = force
+            self._sweep = asyncio.create_task(self._checkAll(force))
+        elif force and not self._sweepForced:
+            self._sweepForced = True
+            self._sweep = asyncio.create_task(self._checkAfter(self._sweep))
+        return await asyncio.shield(self._sweep)
+
+    async def _checkAfter(self, previous:asyncio.Task) -> Dict[str, int]:
+        await asyncio.wait([previous])
+        return await self._checkAll(True)
+
+    def sweepAndReport(self, chatId:int) -> None:
+        """
+        Checks every invite link in the background and sends the report to chatId when done.
+        """
+        task = asyncio.create_task(self._sweepAndReport(chatId))
+        self._reports.add(task)
+        task.add_done_callback(self._reports.discard)
+
+    async def _sweepAndReport(self, chatId:int) -> None:
+        try:
+            await self.sweep(force=True)
+        except Exception as e:
+            self._logger.error(f"link check failed: {e}")
+            await self._send(chatId, [f"Fail because the check of the invite links failed: {e}"])
+            return
+        await self._send(chatId, ["\n".join(self.report())])
+
+    def _fresh(self, tg:GroupRecord, now:float) -> bool:
+        status = self._results.get(tg.unitCode)
+        return status is not None and status.link == tg.link and status.healthy is not None and now - status.checked < self._ttl
+
+    async def _checkAll(self, force:bool) -> Dict[str, int]:
+        now = time.time()
+        codes = set()
+        pending = []
+        for tg in getAsyncDatabase().iterGroups():
+            codes.add(tg.unitCode)
+            if force or not self._fresh(tg, now):
+                pending.append(tg)
+        db = getAsyncDatabase()
+        for unitCode in list(self._results):
+            if unitCode not in codes:
+                del self._results[unitCode]
+                try:
+                    await db.deleteValue(LINK_HEALTH, unitCode)
+                except KeyError:
+                    pass
+        pending.reverse()
+
+        async def work() -> None:
+            while pending:
+                tg = pending.pop()
+                status = await self.check(tg.link)
+                self.record(tg.unitCode, status)
+                await db.putValue(LINK_HEALTH, tg.unitCode, list(status))
+                getDatabase().publish(("health", tg.unitCode, list(status)))
+                _METRICS.inc("bot_link_checks_total", help="invite link checks by result", result=str(status.healthy).lower())
+
+        checked = len(pending)
+        await asyncio.gather(*[work() for _ in range(max(1, min(self._concurrency, checked)))])
+        self._lastSweep = time.time()
+        counts = self.counts()
+        self._logger.info(f"checked {checked} invite links: {counts}")
+        return counts
+
+    def record(self, unitCode:str, status:LinkStatus) -> None:
+        """
+        Keeps the result of a check, which is also how the results of other processes sharing the database arrive.
+        """
+        self._results[unitCode] = status
+        self._lastSweep = max(self._lastSweep, status.checked)
+        getDatabase().setLinkHealth(unitCode, status.link, status.healthy)
+
+    def _url(self, link:str) -> str:
+        if link.startswith(TELEGRAM_LINK):
+            return self._endpoint + link[len(TELEGRAM_LINK):]
+        return link
+
+    async def _polite(self, host:str) -> None:
+        # reserves the next slot of the host before sleeping, so concurrent requests queue up behind each other
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        at = max(now, self._nextRequest.get(host, 0.0))
+        self._nextRequest[host] = at + self._hostDelay
+        if at > now:
+            await asyncio.sleep(at - now)
+
+    async def check(self, link:str) -> LinkStatus:
+        url = self._url(link)
+        host = urlparse(url).netloc
+        detail = ""
+        for attempt in range(self.MAX_RETRIES + 1):
+            if attempt > 0:
+                await asyncio.sleep(delay)
+            await self._polite(host)
+            delay = self.BACKOFF * 2 ** attempt * (1 + random.random() / 2)
+            try:
+                async with self._getSession().get(url, allow_redirects=True) as response:
+                    if response.status == 200:
+                        body = await response.text(errors="replace")
+                        healthy = VALID_MARKER in body
+                        return LinkStatus(link, healthy, time.time(), "ok" if healthy else "expired or revoked")
+                    if response.status == 404:
+                        return LinkStatus(link, False, time.time(), "not found")
+                    detail = f"HTTP {response.status}"
+                    if response.status == 429 or response.status >= 500:
+                        retryAfter = response.headers.get("Retry-After", "")
+                        if retryAfter.isdigit():
+                            delay = max(delay, float(retryAfter))
+                        continue
+                    return LinkStatus(link, None, time.time(), detail)
+            except (ClientError, asyncio.TimeoutError) as e:
+                detail = type(e).__name__
+        return LinkStatus(link, None, time.time(), detail)
+
+    def counts(self) -> Dict[str, int]:
+        counts = {"healthy": 0, "unhealthy": 0, "unknown": 0}
+        for status in self._results.values():
+            if status.healthy is None:
+                counts["unknown"] += 1
+            elif status.healthy:
+                counts["healthy"] += 1
+            else:
+                counts["unhealthy"] += 1
+        return counts
+
+    def report(self, limit:int=50) -> List[str]:
+        """
+        Returns the counts of the last results followed by the unhealthy and unknown links.
+        """
+        counts = self.counts()
+        if self._lastSweep == 0:
+            lines = ["No invite links have been checked yet."]
+        else:
+            lines = [
+                f"Last checked {time.strftime('%Y-%m-%d %H:%M', time.localtime(self._lastSweep))}: "
+                f"{counts['healthy']} healthy, {counts['unhealthy']} unhealthy, {counts['unknown']} could not be checked."
+            ]
+        problems = sorted((unitCode, status) for unitCode, status in self._results.items() if status.healthy is not True)
+        for unitCode, status in problems[:limit]:
+            lines.append(f"{unitCode} {status.link} {status.detail}")
+        if len(problems) > limit:
+            lines.append(f"and {len(problems) - limit} more.")
+        return lines
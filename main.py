@@ -3,19 +3,31 @@ import shelve
 
 import config
 import service
+import monitoring
+import workers
 
 import persistence
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(__name__)
     try:
-        token, admins, dbname = config.readConfig()
+        cfg = config.readConfig()
     except config.ConfigException as e:
+        logging.basicConfig(level=logging.INFO)
         logger.error(e)
         logger.info("suss-telegram-groups bot terminates")
     else:
-        logger.info("suss-telegram-groups bot starts")
-        persistence.setup(dbname, admins)
-        service.setup(token, logger)
-        service.run()
+        # the workers log through the queue of this process
+        records = workers.CONTEXT.Queue() if cfg.workers > 1 else None
+        monitoring.setup(logging.INFO, cfg.logFormat, records=records)
+        try:
+            logger.info("suss-telegram-groups bot starts")
+            if cfg.workers > 1:
+                workers.setup(cfg, logger, records)
+                workers.run()
+            else:
+                persistence.setup(cfg.database, cfg.admins, cfg.backend, cfg.readers, cfg.journal, cfg.journalCheckpoint)
+                service.setup(cfg, logger)
+                service.run()
+        finally:
+            monitoring.shutdown()
@@ -0,0 +1,176 @@
+from typing import Callable, Dict, List, Tuple
+from bisect import bisect_left
+
+import time
+import asyncio
+import functools
+import threading
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels:Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format(labels:Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+class Histogram:
+    def __init__(self, buckets:Tuple[float, ...]=DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, p:float) -> float:
+        """
+        Returns the upper bound of the bucket that holds the p-th percentile.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+class Metrics:
+    """
+    Counters, latency histograms and gauges of the bot, rendered in the Prometheus text format.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._help: Dict[str, str] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def inc(self, name:str, value:float=1, help:str="", **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name:str, value:float, help:str="", **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name:str, fn:Callable[[], float], help:str="") -> None:
+        with self._lock:
+            self._help[name] = help
+            self._gauges[name] = fn
+
+    def timed(self, name:str, help:str="", **labels) -> Callable:
+        """
+        Decorates a function or coroutine function so that its latency is observed in the
+        histogram {name}_seconds and the exceptions it raises are counted in {name}_errors_total.
+        """
+        def decorator(fn:Callable) -> Callable:
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    started = time.perf_counter()
+                    try:
+                        return await fn(*args, **kwargs)
+                    except Exception as e:
+                        self.inc(f"{name}_errors_total", help=f"exceptions counted by error type, see {name}_seconds", error=type(e).__name__, **labels)
+                        raise
+                    finally:
+                        self.observe(f"{name}_seconds", time.perf_counter() - started, help=help, **labels)
+            else:
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    started = time.perf_counter()
+                    try:
+                        return fn(*args, **kwargs)
+                    except Exception as e:
+                        self.inc(f"{name}_errors_total", help=f"exceptions counted by error type, see {name}_seconds", error=type(e).__name__, **labels)
+                        raise
+                    finally:
+                        self.observe(f"{name}_seconds", time.perf_counter() - started, help=help, **labels)
+            return wrapper
+        return decorator
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format(labels)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_format(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format(labels)} {histogram.count}")
+            gauges = sorted(self._gauges.items())
+        for name, fn in gauges:
+            lines.append(f"# HELP {name} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {fn()}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> List[str]:
+        """
+        Returns one line per latency histogram series with its count, errors, p50 and p95,
+        followed by the gauges.
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                base = name[:-len("_seconds")] if name.endswith("_seconds") else name
+                errors = self._counters.get(f"{base}_errors_total", {})
+                for labels, histogram in sorted(series.items()):
+                    failed = sum(value for key, value in errors.items() if set(labels) <= set(key))
+                    what = "".join(" " + value for _, value in labels)
+                    lines.append(
+                        f"{base}{what}: {histogram.count} calls, {int(failed)} errors, "
+                        f"p50 <= {histogram.percentile(0.50) * 1000:g}ms, p95 <= {histogram.percentile(0.95) * 1000:g}ms"
+                    )
+            gauges = sorted(self._gauges.items())
+        for name, fn in gauges:
+            lines.append(f"{name}: {fn():g}")
+        return lines
+
+_METRICS = Metrics()
+
+def getMetrics() -> Metrics:
+    return _METRICS
+
+async def startMetricsServer(host:str, port:int) -> web.AppRunner:
+    async def handle(request:web.Request) -> web.Response:
+        response = web.Response(text=_METRICS.render())
+        response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+        return response
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,19 @@
+import os
+import sys
+import logging
+
+import storage
+from journal import JournaledBackend, JOURNAL_SUFFIX
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+    if len(sys.argv) != 3:
+        logger.error("Usage: python migrate.py [shelve database] [sqlite database]")
+        sys.exit(1)
+    source, target = sys.argv[1], sys.argv[2]
+    if os.path.exists(source + JOURNAL_SUFFIX):
+        # applies the writes journaled by the bot since its last checkpoint
+        JournaledBackend(storage.ShelveBackend(source), source + JOURNAL_SUFFIX).close()
+    count = storage.migrateShelveToSQLite(source, target)
+    logger.info(f"migrated {count} telegram groups from {source} to {target}")
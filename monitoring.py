@@ -0,0 +1,195 @@
+from typing import List, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import sys
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+
+from broadcast import Send
+
+_LISTENER: QueueListener = None
+_SHIPPER: "OpsShipper" = None
+
+# extra of the log records that report the status of the bot to the ops chat, e.g. logger.info("started", extra=STATUS)
+STATUS = {"status": True}
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a log record as a single line of JSON, with the audit event of the record if it has one.
+    """
+    def format(self, record:logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        audit = getattr(record, "audit", None)
+        if audit is not None:
+            entry["audit"] = audit
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+def setup(level:int=logging.INFO, logFormat:str="json", stream=sys.stderr, records=None) -> None:
+    """
+    Routes every log record through a queue to a listener thread, which formats and writes the
+    records and hands them to the ops shipper, so that logging never blocks the event loop.
+    Worker processes log to the same records queue, which must then be a multiprocessing queue.
+    """
+    global _LISTENER, _SHIPPER
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter() if logFormat == "json" else logging.Formatter(logging.BASIC_FORMAT))
+    _SHIPPER = OpsShipper()
+    if records is None:
+        records = queue.SimpleQueue()
+    _LISTENER = QueueListener(records, handler, _SHIPPER, respect_handler_level=True)
+    _route(records, level)
+    _LISTENER.start()
+
+def setupWorker(records, level:int=logging.INFO) -> None:
+    """
+    Routes the log records of a worker process to the listener of the process that started it.
+    """
+    _route(records, level)
+
+def _route(records, level:int) -> None:
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(QueueHandler(records))
+    root.setLevel(level)
+
+def shutdown() -> None:
+    """
+    Writes the records still queued and stops the listener thread.
+    """
+    global _LISTENER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        _LISTENER = None
+
+class OpsShipperNotReadyException(Exception):
+    pass
+
+def getShipper() -> "OpsShipper":
+    global _SHIPPER
+    if _SHIPPER is None:
+        raise OpsShipperNotReadyException()
+    return _SHIPPER
+
+class OpsShipper(logging.Handler):
+    """
+    Collects warnings, errors, audit events and status records and posts them to the ops chat as one
+    digest every interval seconds instead of one message per record. Repeated messages are counted
+    rather than listed again. At most MAX_EVENTS distinct messages are kept between digests, the rest
+    are only counted, and a digest lists at most MAX_LINES of them. Records about the ops chat itself,
+    marked with the extra attribute chat, are not collected.
+    """
+    MAX_EVENTS = 500
+    MAX_LINES = 50
+    MAX_LINE_LENGTH = 300
+
+    def __init__(self) -> None:
+        super().__init__()
+        # records arrive on the listener thread and are shipped from the event loop
+        self._eventsLock = threading.Lock()
+        self._events: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._dropped = 0
+        self._send: Send = None
+        self._chatId: Optional[int] = None
+        self._interval = 60.0
+        self._task: asyncio.Task = None
+
+    def _kind(self, record:logging.LogRecord) -> Optional[str]:
+        if getattr(record, "audit", None) is not None:
+            return "AUDIT"
+        if record.levelno >= logging.WARNING:
+            return record.levelname
+        if getattr(record, "status", False):
+            return "STATUS"
+        return None
+
+    def emit(self, record:logging.LogRecord) -> None:
+        if self._chatId is None:
+            return
+        if getattr(record, "chat", None) == self._chatId:
+            # a failure to post to the ops chat would be posted there with the next digest and fail the same way
+            return
+        kind = self._kind(record)
+        if kind is None:
+            return
+        key = (kind, record.getMessage()[:self.MAX_LINE_LENGTH])
+        with self._eventsLock:
+            if key in self._events:
+                self._events[key] += 1
+            elif len(self._events) < self.MAX_EVENTS:
+                self._events[key] = 1
+            else:
+                self._dropped += 1
+
+    async def start(self, send:Send, chatId:int, interval:float=60) -> None:
+        """
+        Starts posting digests to chatId every interval seconds.
+        """
+        self._send = send
+        self._chatId = chatId
+        self._interval = interval
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the digests after posting what was collected since the last one.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.ship()
+        self._chatId = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            await self.ship()
+
+    def digest(self) -> List[str]:
+        """
+        Takes the records collected since the last digest and returns the lines of the next one.
+        """
+        with self._eventsLock:
+            events, self._events = self._events, OrderedDict()
+            dropped, self._dropped = self._dropped, 0
+        if not events:
+            return []
+        counts = OrderedDict()
+        for (kind, _), count in events.items():
+            counts[kind] = counts.get(kind, 0) + count
+        lines = [f"Bot status {time.strftime('%Y-%m-%d %H:%M')}: " + ", ".join(f"{count} {kind.lower()}" for kind, count in counts.items())]
+        for (kind, message), count in list(events.items())[:self.MAX_LINES]:
+            lines.append(f"{kind} {message}" + (f" (x{count})" if count > 1 else ""))
+        more = max(0, len(events) - self.MAX_LINES) + dropped
+        if more > 0:
+            lines.append(f"and {more} more.")
+        return lines
+
+    async def ship(self) -> None:
+        lines = self.digest()
+        if not lines:
+            return
+        try:
+            sent = await self._send(self._chatId, lines)
+        except Exception:
+            sent = False
+        if not sent:
+            # logged below WARNING, otherwise the failure would be shipped with the next digest and fail the same way
+            logging.getLogger(__name__).info(f"failed to post a digest of {len(lines) - 1} events to the ops chat {self._chatId}")
@@ -1,14 +1,27 @@
-from typing import List, Tuple
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, NamedTuple, Optional, Protocol, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
-import shelve
+import time
+import asyncio
+import threading
 
 from singleton import Singleton
+from storage import openBackend
+from journal import JournaledBackend, JOURNAL_SUFFIX
+from metrics import getMetrics
+from search import SearchIndex, PrefixIndex
+from rbac import Authoriser, ROLE_PERMISSIONS, UnknownRoleException, BadUsernameException, normaliseUsername
+
+_METRICS = getMetrics()
 
 _DATABASE: "SingletonDatabase" = None
+_ASYNC_DATABASE: "AsyncDatabase" = None
 
-def setup(dbname:str, admins:List[str]) -> None:
-    global _DATABASE
-    _DATABASE = SingletonDatabase(dbname, admins)
+def setup(dbname:str, admins:List[str], backend:str="shelve", readers:int=4, journal:bool=True, checkpoint:int=1000,
+          idSuffix:str="") -> None:
+    global _DATABASE, _ASYNC_DATABASE
+    _DATABASE = SingletonDatabase(dbname, admins, backend, journal, checkpoint, idSuffix)
+    _ASYNC_DATABASE = AsyncDatabase(_DATABASE, readers)
 
 class DatabaseNotReadyException(Exception):
     pass
@@ -19,6 +32,20 @@ def getDatabase() -> "SingletonDatabase":
         raise DatabaseNotReadyException()
     return _DATABASE
 
+def getAsyncDatabase() -> "AsyncDatabase":
+    global _ASYNC_DATABASE
+    if _ASYNC_DATABASE is None:
+        raise DatabaseNotReadyException()
+    return _ASYNC_DATABASE
+
+# a change to the state kept in memory, the kind of change followed by its arguments, e.g. ("delete", unit code)
+Change = Tuple
+
+# namespace of the chat id registered for each telegram group
+CHATS = "chats"
+# namespace of the roles granted to each username
+USER_ROLES = "roles"
+
 def _validUnitCode(unitCode:str) -> bool:
     return len(unitCode) == 6 and unitCode[:3].isalpha() and unitCode[3:].isnumeric()
 
@@ -38,11 +65,34 @@ class BadUnitNameException(Exception):
     def __init__(self, unitCode:str):
         super().__init__(f"Bad Unit Name for {unitCode}")
 
+def validateTelegramGroup(unitCode:str, unitName:str, link:str) -> None:
+    if not _validUnitCode(unitCode):
+        raise MalformedUnitCodeException(unitCode)
+    if not link.startswith("https://t.me/"):
+        raise BadTelegramLinkException(unitCode, link)
+    if len(unitName) == 0:
+        raise BadUnitNameException(unitCode)
+
+class GroupRecord(NamedTuple):
+    """
+    Read-only telegram group, for listings that do not modify the groups.
+    """
+    unitCode: str
+    unitName: str
+    link: str
+
+    @property
+    def prefix(self) -> str:
+        return self.unitCode[:3]
+
 class TelegramGroup:
-    def __init__(self, unitCode:str, unitName:str, link:str) -> None:
+    __slots__ = ("_unitCode", "_unitName", "_link", "_healthy", "_db", "_deleted")
+
+    def __init__(self, unitCode:str, unitName:str, link:str, healthy:Optional[bool]=None) -> None:
         self._unitCode = unitCode.upper()
         self._unitName = unitName
         self._link = link
+        self._healthy = healthy
         self._db = getDatabase()
         self._deleted = False
     
@@ -91,6 +141,13 @@ class TelegramGroup:
     def link(self) -> str:
         return self._link
     
+    @property
+    def healthy(self) -> Optional[bool]:
+        """
+        False when the last check found the invite link expired or revoked, None when it has not been checked.
+        """
+        return self._healthy
+
     @property
     def prefix(self) -> str:
         return self._unitCode[:3]
@@ -104,51 +161,555 @@ class TelegramGroup:
     def __gt__(self, other:"TelegramGroup") -> bool:
         return self._unitCode > other.unitCode
 
+class Index(Protocol):
+    """
+    In-memory structure derived from the telegram groups in the store.
+    It is loaded once and then updated by every mutation.
+    """
+    def load(self, rows:List[Tuple[str, str, str]]) -> None: ...
+    def put(self, unitCode:str, unitName:str, link:str) -> None: ...
+    def delete(self, unitCode:str) -> None: ...
+
+class ReplyCache:
+    """
+    Keeps the /get all reply chunks rendered in memory, one chunk per unit code prefix,
+    along with the same listing split into pages of at most PAGE_SIZE groups.
+    Mutations rebuild only the bucket of the affected prefix.
+    """
+    PAGE_SIZE = 15
+
+    def __init__(self) -> None:
+        self._buckets: Dict[str, Dict[str, Tuple[str, str]]] = {}
+        self._rendered: Dict[str, str] = {}
+        self._pages: Dict[str, List[str]] = {}
+        self._pageList: List[Tuple[str, str]] = None
+        self._loaded = False
+        self._hits = 0
+        self._misses = 0
+        self._rebuilds = 0
+
+    def _render(self, prefix:str) -> None:
+        self._pageList = None
+        bucket = self._buckets.get(prefix)
+        if not bucket:
+            self._buckets.pop(prefix, None)
+            self._rendered.pop(prefix, None)
+            self._pages.pop(prefix, None)
+            return
+        entries = []
+        for unitCode in sorted(bucket):
+            unitName, link = bucket[unitCode]
+            entries.append(f"{unitCode} {unitName}\n{link}\n")
+        self._rendered[prefix] = "\n".join(entries)
+        self._pages[prefix] = ["\n".join(entries[i:i + self.PAGE_SIZE]) for i in range(0, len(entries), self.PAGE_SIZE)]
+        self._rebuilds += 1
+
+    def load(self, rows:List[Tuple[str, str, str]]) -> None:
+        self._buckets = {}
+        for unitCode, unitName, link in rows:
+            self._buckets.setdefault(unitCode[:3], {})[unitCode] = (unitName, link)
+        self._rendered = {}
+        self._pages = {}
+        for prefix in list(self._buckets):
+            self._render(prefix)
+        self._loaded = True
+
+    def put(self, unitCode:str, unitName:str, link:str) -> None:
+        if not self._loaded:
+            return
+        prefix = unitCode[:3]
+        self._buckets.setdefault(prefix, {})[unitCode] = (unitName, link)
+        self._render(prefix)
+
+    def delete(self, unitCode:str) -> None:
+        if not self._loaded:
+            return
+        prefix = unitCode[:3]
+        self._buckets.get(prefix, {}).pop(unitCode, None)
+        self._render(prefix)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def replies(self) -> List[str]:
+        return [self._rendered[prefix] for prefix in sorted(self._rendered)]
+
+    def pages(self) -> List[Tuple[str, str]]:
+        """
+        Returns (prefix, text) for every page in unit code order. The list is rebuilt only after a mutation.
+        """
+        if self._pageList is None:
+            self._pageList = [(prefix, page) for prefix in sorted(self._pages) for page in self._pages[prefix]]
+        return self._pageList
+
+    def hit(self) -> None:
+        self._hits += 1
+
+    def miss(self) -> None:
+        self._misses += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "rebuilds": self._rebuilds,
+            "prefixes": len(self._rendered),
+        }
+
 class SingletonDatabase(Singleton):
-    def __init__(self, dbname:str, admins:List[str]):
-        self._db = shelve.open(dbname)
+    def __init__(self, dbname:str, admins:List[str], backend:str="shelve", journal:bool=True, checkpoint:int=1000,
+                 idSuffix:str=""):
+        # without a journal every write batch is synced, which the backend does best as it commits
+        self._db = openBackend(backend, dbname, durable=not journal)
+        if journal:
+            self._db = JournaledBackend(self._db, dbname + JOURNAL_SUFFIX, checkpoint)
         self._admins = admins
+        self._authoriser = Authoriser(admins, dict(self._db.values(USER_ROLES)))
+        self._cache = ReplyCache()
+        # keeps the reply cache consistent with the store across reader and writer threads
+        self._lock = threading.RLock()
+        _METRICS.gauge("bot_reply_cache_hits", lambda: self._cache.stats()["hits"], "/get all replies served from the cache")
+        _METRICS.gauge("bot_reply_cache_misses", lambda: self._cache.stats()["misses"], "/get all replies that loaded the cache")
+        # the reply cache loads itself on the first /get all, other indexes are loaded when added
+        self._indexes: List[Index] = [self._cache]
+        self._search = SearchIndex()
+        self.addIndex(self._search)
+        self._prefix = PrefixIndex()
+        self.addIndex(self._prefix)
+        # unit code to the link last checked and whether it was healthy
+        self._health: Dict[str, Tuple[str, Optional[bool]]] = {}
+        # appended to the ids the bot makes up, so that processes sharing the store never make the same id
+        self.idSuffix = idSuffix
+        self._publisher: Callable[[Change], None] = None
+
+    def addIndex(self, index:Index) -> None:
+        with self._lock:
+            index.load(list(self._db.items()))
+            self._indexes.append(index)
+
+    def _indexPut(self, unitCode:str, unitName:str, link:str) -> None:
+        for index in self._indexes:
+            index.put(unitCode, unitName, link)
+
+    def _indexDelete(self, unitCode:str) -> None:
+        for index in self._indexes:
+            index.delete(unitCode)
     
     def getAdmins(self) -> List[str]:
         return self._admins
+
+    def setAdmins(self, admins:List[str]) -> None:
+        self._admins = admins
+        self._authoriser.setAdmins(admins)
+
+    def getPermissions(self, username:Optional[str]) -> FrozenSet[str]:
+        return self._authoriser.permissions(username)
+
+    def hasPermission(self, username:Optional[str], permission:str) -> bool:
+        return self._authoriser.can(username, permission)
+
+    def getRoles(self, username:Optional[str]) -> List[str]:
+        return self._authoriser.roles(username)
+
+    def getRoleHolders(self) -> Dict[str, List[str]]:
+        return self._authoriser.holders()
+
+    def isConfigAdmin(self, username:Optional[str]) -> bool:
+        return self._authoriser.isConfigAdmin(username)
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="grantRole")
+    def grantRole(self, username:str, role:str) -> bool:
+        """
+        Returns False when the user already held the role.
+        """
+        if role not in ROLE_PERMISSIONS:
+            raise UnknownRoleException(role)
+        if normaliseUsername(username) == "":
+            raise BadUsernameException(username)
+        with self._lock:
+            roles = self._authoriser.grantedRoles(username)
+            if role in roles:
+                return False
+            roles.append(role)
+            self._db.putValue(USER_ROLES, normaliseUsername(username), roles)
+            self._authoriser.setRoles(username, roles)
+        self.publish(("roles", normaliseUsername(username), roles))
+        return True
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="revokeRole")
+    def revokeRole(self, username:str, role:str) -> bool:
+        """
+        Returns False when the role was not granted to the user.
+        """
+        with self._lock:
+            roles = self._authoriser.grantedRoles(username)
+            if role not in roles:
+                return False
+            roles.remove(role)
+            if roles:
+                self._db.putValue(USER_ROLES, normaliseUsername(username), roles)
+            else:
+                self._db.deleteValue(USER_ROLES, normaliseUsername(username))
+            self._authoriser.setRoles(username, roles)
+        self.publish(("roles", normaliseUsername(username), roles))
+        return True
+
+    def _group(self, unitCode:str, unitName:str, link:str) -> TelegramGroup:
+        checkedLink, healthy = self._health.get(unitCode, (None, None))
+        # a result only applies to the link that was checked
+        return TelegramGroup(unitCode, unitName, link, healthy if checkedLink == link else None)
+
+    def setLinkHealth(self, unitCode:str, link:str, healthy:Optional[bool]) -> None:
+        self._health[unitCode] = (link, healthy)
     
+    @_METRICS.timed("bot_db", "latency of database operations", operation="getTelegramGroup")
     def getTelegramGroup(self, unitCode:str) -> TelegramGroup:
         unitCode = unitCode.upper()
         if _validUnitCode(unitCode):
-            if unitCode in self._db:
-                unitName, link = self._db[unitCode]
-                return TelegramGroup(unitCode, unitName, link)
-            raise NoTelegramGroupException(unitCode)
+            try:
+                unitName, link = self._db.get(unitCode)
+            except KeyError:
+                raise NoTelegramGroupException(unitCode)
+            return self._group(unitCode, unitName, link)
         raise MalformedUnitCodeException(unitCode)
     
    
+    @_METRICS.timed("bot_db", "latency of database operations", operation="getTelegramGroups")
     def getTelegramGroups(self) -> List[TelegramGroup]:
-        tgs = []
-        for unitCode in self._db:
-            unitName, link = self._db[unitCode]
-            tgs.append(TelegramGroup(unitCode, unitName, link))
-        return tgs
+        return [self._group(unitCode, unitName, link) for unitCode, unitName, link in self._db.items()]
+
+    def iterGroups(self, prefix:Optional[str]=None, start:Optional[str]=None, limit:Optional[int]=None) -> Iterator[GroupRecord]:
+        """
+        Lazily yields the telegram groups in unit code order, from the unit code start onwards, only those
+        whose unit code begins with prefix, and at most limit of them. The groups are read from the sorted
+        index a chunk at a time, so memory grows with the groups taken rather than with the whole store.
+        """
+        # the scan runs as the groups are taken, so it is timed then rather than when the iterator is made
+        scan = self._prefix.scan(prefix, start, limit)
+        elapsed = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    row = next(scan)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started
+                yield GroupRecord._make(row)
+        finally:
+            _METRICS.observe("bot_db_seconds", elapsed, help="latency of database operations", operation="iterGroups")
+
+    def _loadCache(self) -> None:
+        if not self._cache.loaded:
+            self._cache.miss()
+            self._cache.load(list(self._db.items()))
+        else:
+            self._cache.hit()
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="getTelegramGroupReplies")
+    def getTelegramGroupReplies(self) -> List[str]:
+        with self._lock:
+            self._loadCache()
+            return self._cache.replies()
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="getTelegramGroupPages")
+    def getTelegramGroupPages(self) -> List[Tuple[str, str]]:
+        with self._lock:
+            self._loadCache()
+            return self._cache.pages()
+
+    def getCacheStats(self) -> Dict[str, int]:
+        with self._lock:
+            return self._cache.stats()
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="searchTelegramGroups")
+    def searchTelegramGroups(self, query:str, limit:int=10) -> List[TelegramGroup]:
+        return [self._group(unitCode, unitName, link) for unitCode, unitName, link in self._search.search(query, limit)]
     
+    @_METRICS.timed("bot_db", "latency of database operations", operation="lookupTelegramGroups")
+    def lookupTelegramGroups(self, query:str, offset:int=0, limit:int=50) -> Tuple[List[TelegramGroup], bool]:
+        rows, more = self._prefix.lookup(query, offset, limit)
+        return [self._group(unitCode, unitName, link) for unitCode, unitName, link in rows], more
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="addTelegramGroup")
     def addTelegramGroup(self, unitCode:str, unitName:str, link:str) -> TelegramGroup:
-        if not _validUnitCode(unitCode):
-            raise MalformedUnitCodeException(unitCode)
-        if not link.startswith("https://t.me/"):
-            raise BadTelegramLinkException(unitCode, link)
-        if len(unitName) == 0:
-            raise BadUnitNameException(unitCode)
-        self._db[unitCode] = (unitName, link)
+        validateTelegramGroup(unitCode, unitName, link)
+        with self._lock:
+            self._db.put(unitCode, unitName, link)
+            self._indexPut(unitCode, unitName, link)
+        self.publish(("put", unitCode, unitName, link))
         return TelegramGroup(unitCode, unitName, link)
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="addTelegramGroups")
+    def addTelegramGroups(self, rows:List[Tuple[str, str, str]]) -> int:
+        """
+        Adds (unit code, unit name, link) rows in one atomic write where the backend supports it.
+        """
+        for unitCode, unitName, link in rows:
+            validateTelegramGroup(unitCode, unitName, link)
+        with self._lock:
+            count = self._db.putMany(rows)
+            for unitCode, unitName, link in rows:
+                self._indexPut(unitCode, unitName, link)
+        self.publish(("putMany", rows))
+        return count
     
+    @_METRICS.timed("bot_db", "latency of database operations", operation="read")
     def __getitem__(self, unitCode:str):
-        if unitCode in self._db:
-            return self._db[unitCode]
-        raise KeyError()
+        return self._db.get(unitCode)
     
+    @_METRICS.timed("bot_db", "latency of database operations", operation="write")
     def __setitem__(self, unitCode:str, values:Tuple[str,str]):
-        self._db[unitCode] = values
+        with self._lock:
+            self._db.put(unitCode, *values)
+            self._indexPut(unitCode, *values)
+        self.publish(("put", unitCode, *values))
     
+    @_METRICS.timed("bot_db", "latency of database operations", operation="deleteTelegramGroup")
     def deleteTelegramGroup(self, tg: TelegramGroup) -> None:
-        try:
-            del self._db[tg.unitCode]
-        except KeyError:
-            raise NoTelegramGroupException()
+        with self._lock:
+            try:
+                self._db.delete(tg.unitCode)
+            except KeyError:
+                raise NoTelegramGroupException(tg.unitCode)
+            else:
+                self._indexDelete(tg.unitCode)
+                self._health.pop(tg.unitCode, None)
+            try:
+                self._db.deleteValue(CHATS, tg.unitCode)
+            except KeyError:
+                pass
+        self.publish(("delete", tg.unitCode))
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="registerChat")
+    def registerChat(self, unitCode:str, chatId:int) -> TelegramGroup:
+        tg = self.getTelegramGroup(unitCode)
+        self._db.putValue(CHATS, tg.unitCode, chatId)
+        return tg
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="getChats")
+    def getChats(self, prefix:Optional[str]=None) -> List[Tuple[str, int]]:
+        """
+        Returns (unit code, chat id) for every registered telegram group, optionally only those of a unit code prefix.
+        """
+        return [(unitCode, chatId) for unitCode, chatId in self._db.values(CHATS) if prefix is None or unitCode.startswith(prefix)]
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="getValue")
+    def getValue(self, namespace:str, key:str) -> Any:
+        return self._db.getValue(namespace, key)
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="getValues")
+    def getValues(self, namespace:str) -> List[Tuple[str, Any]]:
+        return list(self._db.values(namespace))
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="putValue")
+    def putValue(self, namespace:str, key:str, value:Any) -> None:
+        self._db.putValue(namespace, key, value)
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="deleteValue")
+    def deleteValue(self, namespace:str, key:str) -> None:
+        self._db.deleteValue(namespace, key)
+
+    @_METRICS.timed("bot_db", "latency of database operations", operation="sync")
+    def sync(self) -> None:
+        """
+        Makes every write so far durable.
+        """
+        self._db.sync()
+
+    def setPublisher(self, publisher:Callable[[Change], None]) -> None:
+        """
+        Sets where the changes to the in-memory state are published for other processes sharing the store.
+        """
+        self._publisher = publisher
+
+    def publish(self, change:Change) -> None:
+        if self._publisher is not None:
+            self._publisher(change)
+
+    def applyChange(self, change:Change) -> None:
+        """
+        Applies a change published by another process to the indexes and the roles in memory.
+        The store already holds it.
+        """
+        kind = change[0]
+        with self._lock:
+            if kind == "put":
+                self._indexPut(*change[1:])
+            elif kind == "putMany":
+                for unitCode, unitName, link in change[1]:
+                    self._indexPut(unitCode, unitName, link)
+            elif kind == "delete":
+                self._indexDelete(change[1])
+                self._health.pop(change[1], None)
+            elif kind == "roles":
+                self._authoriser.setRoles(change[1], change[2])
+
+    def close(self) -> None:
+        self._db.close()
+
+class AsyncDatabase:
+    """
+    Awaitable front of SingletonDatabase for use on the event loop.
+    Reads run on a bounded thread pool. Writes are queued to a single writer task
+    which applies them one at a time on a dedicated thread. The writes queued while
+    a batch is applied form the next batch, which is made durable with one sync
+    before any of its writes is acknowledged.
+    """
+    # most writes applied and synced together
+    WRITE_BATCH = 100
+
+    def __init__(self, db:SingletonDatabase, readers:int=4) -> None:
+        self._db = db
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._queue: asyncio.Queue = None
+        self._writerTask: asyncio.Task = None
+
+    async def _read(self, fn:Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, fn, *args)
+
+    async def _write(self, fn:Callable, *args) -> Any:
+        if self._writerTask is None or self._writerTask.done():
+            self._queue = asyncio.Queue()
+            self._writerTask = asyncio.create_task(self._writeLoop())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, args, future))
+        return await future
+
+    def _apply(self, batch:List[Tuple[Callable, tuple, asyncio.Future]]) -> List[Tuple[bool, Any]]:
+        outcomes = []
+        for fn, args, _ in batch:
+            try:
+                outcomes.append((True, fn(*args)))
+            except Exception as e:
+                outcomes.append((False, e))
+        self._db.sync()
+        return outcomes
+
+    async def _writeLoop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.WRITE_BATCH and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            _METRICS.inc("bot_db_write_batches_total", help="batches of writes made durable by one sync")
+            _METRICS.inc("bot_db_writes_total", len(batch), help="writes applied by the writer thread")
+            try:
+                outcomes = await loop.run_in_executor(self._writer, self._apply, batch)
+            except Exception as e:
+                # the writes were applied but may not be durable
+                outcomes = [(False, e)] * len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            for (_, _, future), (ok, result) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+
+    def getAdmins(self) -> List[str]:
+        return self._db.getAdmins()
+
+    def getPermissions(self, username:Optional[str]) -> FrozenSet[str]:
+        return self._db.getPermissions(username)
+
+    def hasPermission(self, username:Optional[str], permission:str) -> bool:
+        return self._db.hasPermission(username, permission)
+
+    def getRoles(self, username:Optional[str]) -> List[str]:
+        return self._db.getRoles(username)
+
+    def getRoleHolders(self) -> Dict[str, List[str]]:
+        return self._db.getRoleHolders()
+
+    def isConfigAdmin(self, username:Optional[str]) -> bool:
+        return self._db.isConfigAdmin(username)
+
+    async def grantRole(self, username:str, role:str) -> bool:
+        return await self._write(self._db.grantRole, username, role)
+
+    async def revokeRole(self, username:str, role:str) -> bool:
+        return await self._write(self._db.revokeRole, username, role)
+
+    async def getTelegramGroup(self, unitCode:str) -> TelegramGroup:
+        return await self._read(self._db.getTelegramGroup, unitCode)
+
+    async def getTelegramGroups(self) -> List[TelegramGroup]:
+        return await self._read(self._db.getTelegramGroups)
+
+    async def getTelegramGroupReplies(self) -> List[str]:
+        return await self._read(self._db.getTelegramGroupReplies)
+
+    async def getTelegramGroupPages(self) -> List[Tuple[str, str]]:
+        return await self._read(self._db.getTelegramGroupPages)
+
+    def getCacheStats(self) -> Dict[str, int]:
+        return self._db.getCacheStats()
+
+    def searchTelegramGroups(self, query:str, limit:int=10) -> List[TelegramGroup]:
+        # served from memory, so it does not need a reader thread
+        return self._db.searchTelegramGroups(query, limit)
+
+    def lookupTelegramGroups(self, query:str, offset:int=0, limit:int=50) -> Tuple[List[TelegramGroup], bool]:
+        return self._db.lookupTelegramGroups(query, offset, limit)
+
+    def iterGroups(self, prefix:Optional[str]=None, start:Optional[str]=None, limit:Optional[int]=None) -> Iterator[GroupRecord]:
+        # served from memory a chunk at a time, so it does not need a reader thread
+        return self._db.iterGroups(prefix, start, limit)
+
+    async def addTelegramGroup(self, unitCode:str, unitName:str, link:str) -> TelegramGroup:
+        return await self._write(self._db.addTelegramGroup, unitCode, unitName, link)
+
+    async def addTelegramGroups(self, rows:List[Tuple[str, str, str]]) -> int:
+        return await self._write(self._db.addTelegramGroups, rows)
+
+    async def updateLink(self, tg:TelegramGroup, link:str) -> None:
+        await self._write(tg.updateLink, link)
+
+    async def updateUnitName(self, tg:TelegramGroup, unitName:str) -> None:
+        await self._write(tg.updateUnitName, unitName)
+
+    async def deleteTelegramGroup(self, tg:TelegramGroup) -> None:
+        await self._write(tg.delete)
+
+    async def registerChat(self, unitCode:str, chatId:int) -> TelegramGroup:
+        return await self._write(self._db.registerChat, unitCode, chatId)
+
+    async def getChats(self, prefix:Optional[str]=None) -> List[Tuple[str, int]]:
+        return await self._read(self._db.getChats, prefix)
+
+    async def getValue(self, namespace:str, key:str) -> Any:
+        return await self._read(self._db.getValue, namespace, key)
+
+    async def getValues(self, namespace:str) -> List[Tuple[str, Any]]:
+        return await self._read(self._db.getValues, namespace)
+
+    async def putValue(self, namespace:str, key:str, value:Any) -> None:
+        await self._write(self._db.putValue, namespace, key, value)
+
+    async def deleteValue(self, namespace:str, key:str) -> None:
+        await self._write(self._db.deleteValue, namespace, key)
+
+    async def drain(self) -> None:
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self) -> None:
+        """
+        Waits for the queued writes, then syncs and closes the database.
+        """
+        await self.drain()
+        if self._writerTask is not None:
+            self._writerTask.cancel()
+            await asyncio.gather(self._writerTask, return_exceptions=True)
+            self._writerTask = None
+        await asyncio.get_running_loop().run_in_executor(self._writer, self._db.close)
+        self._readers.shutdown(wait=False)
+        self._writer.shutdown(wait=False)
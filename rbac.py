@@ -0,0 +1,121 @@
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+import threading
+
+# permissions are named after the commands they allow
+ADD = "add"
+UPDATE = "update"
+REMOVE = "rm"
+STATS = "stats"
+IMPORT = "import"
+EXPORT = "export"
+REGISTER = "register"
+BROADCAST = "broadcast"
+REMIND = "remind"
+HEALTH = "health"
+ROLES = "roles"
+
+PERMISSIONS = frozenset([ADD, UPDATE, REMOVE, STATS, IMPORT, EXPORT, REGISTER, BROADCAST, REMIND, HEALTH, ROLES])
+
+ADMIN = "admin"
+
+ROLE_PERMISSIONS: Dict[str, FrozenSet[str]] = {
+    ADMIN: PERMISSIONS,
+    "editor": frozenset([ADD, UPDATE, REMOVE, IMPORT, EXPORT, STATS, HEALTH]),
+    "announcer": frozenset([REGISTER, BROADCAST, REMIND]),
+}
+
+_NO_PERMISSIONS: FrozenSet[str] = frozenset()
+
+class UnknownRoleException(Exception):
+    def __init__(self, role:str) -> None:
+        super().__init__(f"{role} is not a known role, expected one of {', '.join(sorted(ROLE_PERMISSIONS))}")
+
+class BadUsernameException(Exception):
+    def __init__(self, username:Optional[str]) -> None:
+        super().__init__(f"{username!r} is not a username")
+
+def normaliseUsername(username:Optional[str]) -> str:
+    # Telegram usernames are case insensitive and are often written with the @
+    return (username or "").strip().lstrip("@").lower()
+
+def _usernames(usernames:Iterable[Optional[str]]) -> Set[str]:
+    # users without a username all normalise to "", which must never hold a role
+    return {normaliseUsername(username) for username in usernames} - {""}
+
+class Authoriser:
+    """
+    Resolves the permissions of users from the roles granted to them and from the admins in the config,
+    who always hold the admin role. The permissions of a user who holds a role are computed once and
+    cached until the roles of the user or the admins change. Users without a role are not cached.
+    """
+    def __init__(self, admins:Iterable[str], roles:Dict[str, List[str]]) -> None:
+        self._lock = threading.Lock()
+        self._admins: Set[str] = _usernames(admins)
+        self._roles: Dict[str, Set[str]] = {
+            normaliseUsername(username): set(granted) for username, granted in roles.items() if normaliseUsername(username) != ""
+        }
+        self._permissions: Dict[str, FrozenSet[str]] = {}
+
+    def permissions(self, username:Optional[str]) -> FrozenSet[str]:
+        username = normaliseUsername(username)
+        if username == "":
+            return _NO_PERMISSIONS
+        permissions = self._permissions.get(username)
+        if permissions is None:
+            with self._lock:
+                roles = self._rolesOf(username)
+                if not roles:
+                    # every user the bot ever sees would otherwise get an entry
+                    return _NO_PERMISSIONS
+                permissions = frozenset().union(*[ROLE_PERMISSIONS.get(role, frozenset()) for role in roles])
+                self._permissions[username] = permissions
+        return permissions
+
+    def can(self, username:Optional[str], permission:str) -> bool:
+        return permission in self.permissions(username)
+
+    def _rolesOf(self, username:str) -> Set[str]:
+        roles = set(self._roles.get(username, ()))
+        if username in self._admins:
+            roles.add(ADMIN)
+        return roles
+
+    def roles(self, username:Optional[str]) -> List[str]:
+        with self._lock:
+            return sorted(self._rolesOf(normaliseUsername(username)))
+
+    def grantedRoles(self, username:Optional[str]) -> List[str]:
+        """
+        Returns the roles granted with /grant, leaving out the admin role that comes from the config.
+        """
+        with self._lock:
+            return sorted(self._roles.get(normaliseUsername(username), ()))
+
+    def holders(self) -> Dict[str, List[str]]:
+        with self._lock:
+            usernames = set(self._roles) | self._admins
+            return {username: sorted(self._rolesOf(username)) for username in sorted(usernames)}
+
+    def isConfigAdmin(self, username:Optional[str]) -> bool:
+        return normaliseUsername(username) in self._admins
+
+    def setRoles(self, username:str, roles:Iterable[str]) -> None:
+        username = normaliseUsername(username)
+        if username == "":
+            raise BadUsernameException(username)
+        roles = set(roles)
+        for role in roles:
+            if role not in ROLE_PERMISSIONS:
+                raise UnknownRoleException(role)
+        with self._lock:
+            if roles:
+                self._roles[username] = roles
+            else:
+                self._roles.pop(username, None)
+            self._permissions.pop(username, None)
+
+    def setAdmins(self, admins:Iterable[str]) -> None:
+        with self._lock:
+            self._admins = _usernames(admins)
+            self._permissions = {}
@@ -0,0 +1,221 @@
+from typing import Any, Dict, List, Set, Tuple
+from logging import Logger
+
+import time
+import heapq
+import asyncio
+
+from persistence import getDatabase, getAsyncDatabase
+from metrics import getMetrics
+from broadcast import Send
+
+_METRICS = getMetrics()
+
+_SCHEDULER: "ReminderScheduler" = None
+
+# namespace of the pending reminders, keyed by reminder id
+REMINDERS = "reminders"
+# namespace of the subscriptions, keyed by "unit code:chat id"
+SUBSCRIPTIONS = "subscriptions"
+
+def setup(send:Send, logger:Logger, lead:float=24 * 3600) -> None:
+    global _SCHEDULER
+    _SCHEDULER = ReminderScheduler(send, logger, lead)
+
+class ReminderSchedulerNotReadyException(Exception):
+    pass
+
+def getReminderScheduler() -> "ReminderScheduler":
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        raise ReminderSchedulerNotReadyException()
+    return _SCHEDULER
+
+class ReminderScheduler:
+    """
+    Sends the deadline reminders of a unit to its subscribers lead seconds before the deadline.
+    Pending reminders are kept in a heap ordered by when they are due, and a single task sleeps
+    until the earliest one. Reminders that fall due together are sent as one message per chat,
+    with at most BATCH_SIZE sends in flight at once.
+    """
+    BATCH_SIZE = 100
+    # wakes up at least this often so that changes of the wall clock are noticed
+    MAX_SLEEP = 60.0
+    # seconds before reminders whose delivery failed are tried again
+    RETRY_DELAY = 60.0
+
+    def __init__(self, send:Send, logger:Logger, lead:float=24 * 3600) -> None:
+        self._send = send
+        self._logger = logger
+        self._lead = lead
+        self._heap: List[Tuple[float, str]] = []
+        self._reminders: Dict[str, Dict[str, Any]] = {}
+        self._subscribers: Dict[str, Set[int]] = {}
+        self._wakeup: asyncio.Event = None
+        self._task: asyncio.Task = None
+        # only the process that sends the reminders keeps them in the heap
+        self._delivering = False
+        self._lastId = 0
+        _METRICS.gauge("bot_reminders_pending", lambda: len(self._reminders), "reminders waiting to be sent")
+        _METRICS.gauge("bot_subscriptions", lambda: sum(len(chats) for chats in self._subscribers.values()), "unit subscriptions")
+
+    async def start(self, deliver:bool=True) -> None:
+        """
+        Loads the reminders and subscriptions from the database and starts sending reminders,
+        unless deliver is False, when another process sharing the database sends them.
+        """
+        db = getAsyncDatabase()
+        self._reminders = dict(await db.getValues(REMINDERS))
+        self._delivering = deliver
+        self._heap = [(reminder["at"], reminderId) for reminderId, reminder in self._reminders.items()] if deliver else []
+        heapq.heapify(self._heap)
+        self._subscribers = {}
+        for key, _ in await db.getValues(SUBSCRIPTIONS):
+            unitCode, chatId = key.split(":")
+            self._subscribers.setdefault(unitCode, set()).add(int(chatId))
+        self._wakeup = asyncio.Event()
+        if deliver:
+            self._task = asyncio.create_task(self._run())
+        self._logger.info(f"loaded {len(self._reminders)} reminders and {sum(len(chats) for chats in self._subscribers.values())} subscriptions")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _nextId(self) -> str:
+        # ids increase with time so that the store lists reminders in the order they were added
+        self._lastId = max(self._lastId + 1, int(time.time() * 1000))
+        return str(self._lastId) + getDatabase().idSuffix
+
+    async def remind(self, unitCode:str, due:float, text:str) -> float:
+        """
+        Adds a reminder of the deadline due (a UNIX timestamp) for unitCode and returns when it will be sent.
+        """
+        at = max(time.time(), due - self._lead)
+        reminderId = self._nextId()
+        reminder = {"unit": unitCode, "due": due, "at": at, "text": text}
+        await getAsyncDatabase().putValue(REMINDERS, reminderId, reminder)
+        self._add(reminderId, reminder)
+        getDatabase().publish(("remind", reminderId, reminder))
+        return at
+
+    def _add(self, reminderId:str, reminder:Dict[str, Any]) -> None:
+        # a reminder relayed by another worker may already have been loaded from the database
+        if reminderId in self._reminders:
+            return
+        self._reminders[reminderId] = reminder
+        if not self._delivering:
+            return
+        heapq.heappush(self._heap, (reminder["at"], reminderId))
+        if self._heap[0][1] == reminderId and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def subscribe(self, unitCode:str, chatId:int) -> bool:
+        """
+        Returns False when the chat was already subscribed to unitCode.
+        """
+        chats = self._subscribers.setdefault(unitCode, set())
+        if chatId in chats:
+            return False
+        await getAsyncDatabase().putValue(SUBSCRIPTIONS, f"{unitCode}:{chatId}", True)
+        chats.add(chatId)
+        getDatabase().publish(("subscribe", unitCode, chatId))
+        return True
+
+    async def unsubscribe(self, unitCode:str, chatId:int) -> bool:
+        """
+        Returns False when the chat was not subscribed to unitCode.
+        """
+        chats = self._subscribers.get(unitCode, set())
+        if chatId not in chats:
+            return False
+        await getAsyncDatabase().deleteValue(SUBSCRIPTIONS, f"{unitCode}:{chatId}")
+        self._discard(unitCode, chatId)
+        getDatabase().publish(("unsubscribe", unitCode, chatId))
+        return True
+
+    def _discard(self, unitCode:str, chatId:int) -> None:
+        chats = self._subscribers.get(unitCode, set())
+        chats.discard(chatId)
+        if not chats:
+            self._subscribers.pop(unitCode, None)
+
+    def applyChange(self, change:Tuple) -> None:
+        """
+        Applies a reminder or subscription added or removed by another process sharing the database.
+        """
+        kind = change[0]
+        if kind == "remind":
+            self._add(change[1], change[2])
+        elif kind == "subscribe":
+            self._subscribers.setdefault(change[1], set()).add(change[2])
+        elif kind == "unsubscribe":
+            self._discard(change[1], change[2])
+        elif kind == "reminded":
+            for reminderId in change[1]:
+                self._reminders.pop(reminderId, None)
+
+    def subscriptions(self, chatId:int) -> List[str]:
+        return sorted(unitCode for unitCode, chats in self._subscribers.items() if chatId in chats)
+
+    async def _run(self) -> None:
+        while True:
+            if self._heap:
+                delay = min(self._heap[0][0] - time.time(), self.MAX_SLEEP)
+            else:
+                delay = self.MAX_SLEEP
+            if delay > 0:
+                self._wakeup.clear()
+                # asyncio.wait rather than wait_for, which can swallow a cancellation that races the wakeup
+                waiter = asyncio.ensure_future(self._wakeup.wait())
+                try:
+                    await asyncio.wait([waiter], timeout=delay)
+                finally:
+                    waiter.cancel()
+                continue
+            now = time.time()
+            # a dict keeps the order of the heap and lists a reminder in it twice only once
+            due: Dict[str, None] = {}
+            while self._heap and self._heap[0][0] <= now:
+                _, reminderId = heapq.heappop(self._heap)
+                if reminderId in self._reminders:
+                    due[reminderId] = None
+            try:
+                await self._deliver(list(due))
+            except Exception as e:
+                self._logger.error(f"failed to deliver {len(due)} reminders, trying again in {self.RETRY_DELAY:g}s: {e}")
+            finally:
+                # the reminders left are only removed once delivered, so they go back on the heap
+                # when delivery failed or was cancelled
+                retry = time.time() + self.RETRY_DELAY
+                for reminderId in due:
+                    if reminderId in self._reminders:
+                        heapq.heappush(self._heap, (retry, reminderId))
+
+    async def _deliver(self, reminderIds:List[str]) -> None:
+        reminderIds = [reminderId for reminderId in reminderIds if reminderId in self._reminders]
+        messages: Dict[int, List[str]] = {}
+        for reminderId in reminderIds:
+            reminder = self._reminders[reminderId]
+            deadline = time.strftime("%Y-%m-%d %H:%M", time.localtime(reminder["due"]))
+            text = f"Reminder for {reminder['unit']}: {reminder['text']} (due {deadline})"
+            for chatId in self._subscribers.get(reminder["unit"], ()):
+                messages.setdefault(chatId, []).append(text)
+        chats = list(messages.items())
+        sent = 0
+        for i in range(0, len(chats), self.BATCH_SIZE):
+            results = await asyncio.gather(*[self._send(chatId, texts) for chatId, texts in chats[i:i + self.BATCH_SIZE]],
+                                           return_exceptions=True)
+            sent += sum(1 for result in results if result is True)
+        _METRICS.inc("bot_reminders_sent_total", len(reminderIds), help="reminders that fell due")
+        db = getAsyncDatabase()
+        for reminderId in reminderIds:
+            try:
+                await db.deleteValue(REMINDERS, reminderId)
+            except KeyError:
+                pass
+            self._reminders.pop(reminderId, None)
+        getDatabase().publish(("reminded", reminderIds))
+        self._logger.info(f"sent {len(reminderIds)} reminders to {sent} of {len(chats)} chats")
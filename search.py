@@ -0,0 +1,196 @@
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from collections import Counter
+
+import re
+import heapq
+import bisect
+import threading
+
+def _normalise(text:str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+def _trigrams(text:str) -> Set[str]:
+    grams = set()
+    for word in _normalise(text):
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+class SearchIndex:
+    """
+    In-memory trigram index over unit codes and unit names.
+    Matching is case insensitive and tolerates typos because results only need to share
+    most of the trigrams of the query. It is loaded once from the store and then kept up
+    to date by every add, update and remove.
+    """
+    MIN_SIMILARITY = 0.4
+
+    def __init__(self) -> None:
+        self._docs: Dict[str, Tuple[str, str, Set[str], str]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, rows:List[Tuple[str, str, str]]) -> None:
+        with self._lock:
+            self._docs = {}
+            self._postings = {}
+            for unitCode, unitName, link in rows:
+                self._add(unitCode, unitName, link)
+
+    def _add(self, unitCode:str, unitName:str, link:str) -> None:
+        grams = _trigrams(f"{unitCode} {unitName}")
+        self._docs[unitCode] = (unitName, link, grams, "".join(_normalise(unitName)))
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(unitCode)
+
+    def _remove(self, unitCode:str) -> None:
+        doc = self._docs.pop(unitCode, None)
+        if doc is None:
+            return
+        for gram in doc[2]:
+            codes = self._postings.get(gram)
+            if codes is not None:
+                codes.discard(unitCode)
+                if not codes:
+                    del self._postings[gram]
+
+    def put(self, unitCode:str, unitName:str, link:str) -> None:
+        with self._lock:
+            self._remove(unitCode)
+            self._add(unitCode, unitName, link)
+
+    def delete(self, unitCode:str) -> None:
+        with self._lock:
+            self._remove(unitCode)
+
+    def search(self, query:str, limit:int=10) -> List[Tuple[str, str, str]]:
+        """
+        Returns up to limit (unit code, unit name, link) tuples, best match first.
+        """
+        grams = _trigrams(query)
+        if not grams:
+            return []
+        needle = "".join(_normalise(query))
+        with self._lock:
+            shared = Counter()
+            for gram in grams:
+                shared.update(self._postings.get(gram, ()))
+            threshold = self.MIN_SIMILARITY * len(grams)
+            scored = []
+            for unitCode, count in shared.items():
+                if count < threshold:
+                    continue
+                unitName, link, docGrams, name = self._docs[unitCode]
+                # exact and prefix matches on the unit code rank first, then substrings of the name
+                code = unitCode.lower()
+                boost = 0.0
+                if needle == code:
+                    boost = 3.0
+                elif code.startswith(needle):
+                    boost = 2.0
+                elif needle in name:
+                    boost = 1.0
+                # the second key prefers shorter names, which match the query more closely
+                scored.append((-(count / len(grams) + boost), -count / len(docGrams), unitCode, unitName, link))
+        return [(unitCode, unitName, link) for _, _, unitCode, unitName, link in heapq.nsmallest(limit, scored)]
+
+class PrefixIndex:
+    """
+    Sorted index of the unit codes and of every word of the unit names, for prefix lookups.
+    The entries are kept sorted on every add, update and remove, so a lookup is a binary search
+    followed by a scan over the matching entries only.
+    """
+    # unit codes copied out of the index at a time by scan
+    SCAN_CHUNK = 256
+
+    def __init__(self) -> None:
+        self._docs: Dict[str, Tuple[str, str]] = {}
+        self._codes: List[str] = []
+        self._keys: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entries(unitCode:str, unitName:str) -> Set[Tuple[str, str]]:
+        return {(key, unitCode) for key in [unitCode.lower()] + _normalise(unitName)}
+
+    def load(self, rows:List[Tuple[str, str, str]]) -> None:
+        with self._lock:
+            self._docs = {unitCode: (unitName, link) for unitCode, unitName, link in rows}
+            self._codes = sorted(self._docs)
+            self._keys = sorted(entry for unitCode, (unitName, _) in self._docs.items() for entry in self._entries(unitCode, unitName))
+
+    def _remove(self, unitCode:str) -> None:
+        doc = self._docs.pop(unitCode, None)
+        if doc is None:
+            return
+        del self._codes[bisect.bisect_left(self._codes, unitCode)]
+        for entry in self._entries(unitCode, doc[0]):
+            i = bisect.bisect_left(self._keys, entry)
+            if i < len(self._keys) and self._keys[i] == entry:
+                del self._keys[i]
+
+    def put(self, unitCode:str, unitName:str, link:str) -> None:
+        with self._lock:
+            self._remove(unitCode)
+            self._docs[unitCode] = (unitName, link)
+            bisect.insort(self._codes, unitCode)
+            for entry in self._entries(unitCode, unitName):
+                bisect.insort(self._keys, entry)
+
+    def delete(self, unitCode:str) -> None:
+        with self._lock:
+            self._remove(unitCode)
+
+    def lookup(self, query:str, offset:int=0, limit:int=50) -> Tuple[List[Tuple[str, str, str]], bool]:
+        """
+        Returns up to limit (unit code, unit name, link) tuples after skipping offset matches, in
+        unit code order, and whether more matches follow. Every word of the query must be a prefix
+        of the unit code or of a word of the unit name.
+        """
+        words = _normalise(query)
+        with self._lock:
+            if not words:
+                codes = self._codes[offset:offset + limit + 1]
+            else:
+                # scan the longest word, which has the fewest matches, and filter on the others
+                scan = max(words, key=len)
+                others = [word for word in words if word != scan]
+                matches = set()
+                i = bisect.bisect_left(self._keys, (scan, ""))
+                while i < len(self._keys) and self._keys[i][0].startswith(scan):
+                    unitCode = self._keys[i][1]
+                    if unitCode not in matches and all(self._matches(unitCode, word) for word in others):
+                        matches.add(unitCode)
+                    i += 1
+                codes = sorted(matches)[offset:offset + limit + 1]
+            rows = [(unitCode, *self._docs[unitCode]) for unitCode in codes[:limit]]
+        return rows, len(codes) > limit
+
+    def _matches(self, unitCode:str, word:str) -> bool:
+        return unitCode.lower().startswith(word) or any(key.startswith(word) for key in _normalise(self._docs[unitCode][0]))
+
+    def scan(self, prefix:Optional[str]=None, start:Optional[str]=None, limit:Optional[int]=None) -> Iterator[Tuple[str, str, str]]:
+        """
+        Lazily yields (unit code, unit name, link) in unit code order from start onwards, only for
+        unit codes that begin with prefix, and at most limit of them. The lock is held only while a
+        chunk of SCAN_CHUNK entries is copied, so writes are never blocked by a slow reader.
+        """
+        prefix = (prefix or "").upper()
+        lower = max(prefix, (start or "").upper())
+        after = False
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = self.SCAN_CHUNK if remaining is None else min(self.SCAN_CHUNK, remaining)
+            with self._lock:
+                i = bisect.bisect_right(self._codes, lower) if after else bisect.bisect_left(self._codes, lower)
+                codes = self._codes[i:i + size]
+                chunk = [(unitCode, *self._docs[unitCode]) for unitCode in codes if unitCode.startswith(prefix)]
+            yield from chunk
+            if len(chunk) < size:
+                # either the index or the unit codes with the prefix have run out
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            lower = chunk[-1][0]
+            after = True
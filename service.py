@@ -1,20 +1,40 @@
-from typing import List
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+from collections import OrderedDict, deque
+from urllib.parse import urlparse
 
+import io
+import os
+import hmac
+import time
 import shelve
+import signal
 import logging
 import asyncio
 
 import telebot
 from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from aiohttp import web
 
+from config import Config, ConfigException, readConfig, ENV_FILE
 from singleton import Singleton
-from businesslogic import User, Admin, NonAdminUserException
+from metrics import getMetrics, startMetricsServer
+import broadcast
+import reminders
+import linkhealth
+import audit
+import monitoring
+from flood import FloodMiddleware
+from businesslogic import User, Admin, NonAdminUserException, BROWSE
+from persistence import getDatabase, getAsyncDatabase
+import rbac
 
 _SERVICE = None
+_METRICS = getMetrics()
 
-def setup(token:str, logger:logging.Logger):
+def setup(config:Config, logger:logging.Logger):
     global _SERVICE
-    _SERVICE = SingletonService(token, logger)
+    _SERVICE = SingletonService(config, logger)
 
 class ServiceNotReadyException(Exception):
     pass
@@ -25,103 +45,775 @@ def run():
         raise ServiceNotReadyException()
     _SERVICE.run()
     
+MAX_MESSAGE_LENGTH = 4096
+MAX_DOWNLOAD_SIZE = 20 * 1024 * 1024
+
+class TokenBucket:
+    def __init__(self, rate:float, capacity:float) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Takes a token if one is available and returns 0.
+        Otherwise returns the number of seconds until the next token is available.
+        """
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    async def acquire(self) -> None:
+        delay = self.take()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.take()
+
+class _Outgoing:
+    def __init__(self, chatId:int, text:str, replyTo:Optional[telebot.types.Message], kwargs:dict,
+                 document:Optional[Tuple[str, bytes]]=None, editMessageId:Optional[int]=None) -> None:
+        self.chatId = chatId
+        self.text = text
+        self.replyTo = replyTo
+        self.kwargs = kwargs
+        self.document = document
+        self.editMessageId = editMessageId
+        self.enqueued = time.monotonic()
+        self.retries = 0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+def coalesce(texts:List[str], limit:int=MAX_MESSAGE_LENGTH) -> List[str]:
+    """
+    Packs consecutive texts into as few messages as possible without exceeding limit characters.
+    Texts longer than limit are split on line boundaries.
+    """
+    pieces = []
+    for text in texts:
+        while len(text) > limit:
+            cut = text.rfind("\n", 0, limit)
+            if cut <= 0:
+                cut = limit
+            pieces.append(text[:cut])
+            text = text[cut:].lstrip("\n")
+        pieces.append(text)
+    messages = []
+    for piece in pieces:
+        if messages and len(messages[-1]) + 1 + len(piece) <= limit:
+            messages[-1] = messages[-1] + "\n" + piece
+        else:
+            messages.append(piece)
+    return messages
+
+class SendScheduler:
+    """
+    Central queue for outbound messages.
+    Messages to the same chat are sent in order. Sends are limited by a global token bucket and
+    a token bucket per chat, and a 429 response pauses the chat for the retry_after given by Telegram.
+    """
+    MAX_RETRIES = 5
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, bot:AsyncTeleBot, logger:logging.Logger, globalRate:float=30, chatRate:float=1,
+                 chatBurst:float=3, workers:int=4) -> None:
+        self._bot = bot
+        self._logger = logger
+        self._global = TokenBucket(globalRate, globalRate)
+        self._chatRate = chatRate
+        self._chatBurst = chatBurst
+        self._chatBuckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._pending: Dict[int, Deque[_Outgoing]] = {}
+        self._pausedUntil: Dict[int, float] = {}
+        self._workerCount = workers
+        self._ready: asyncio.Queue = None
+        self._workers: List[asyncio.Task] = []
+        self._depth = 0
+        self._throttled = 0
+        _METRICS.gauge("bot_send_queue_depth", lambda: self._depth, "messages waiting to be sent")
+        _METRICS.gauge("bot_send_throttled", lambda: self._throttled, "sends retried after a 429 response")
+
+    def _start(self) -> None:
+        if self._ready is None or all(worker.done() for worker in self._workers):
+            self._ready = asyncio.Queue()
+            self._workers = [asyncio.create_task(self._work()) for _ in range(self._workerCount)]
+
+    def _chatBucket(self, chatId:int) -> TokenBucket:
+        bucket = self._chatBuckets.get(chatId)
+        if bucket is None:
+            bucket = TokenBucket(self._chatRate, self._chatBurst)
+            self._chatBuckets[chatId] = bucket
+            if len(self._chatBuckets) > self.MAX_CHAT_BUCKETS:
+                self._chatBuckets.popitem(last=False)
+        else:
+            self._chatBuckets.move_to_end(chatId)
+        return bucket
+
+    async def _enqueue(self, chatId:int, texts:List[str], replyTo:Optional[telebot.types.Message], kwargs:dict,
+                       document:Optional[Tuple[str, bytes]]=None, editMessageId:Optional[int]=None) -> bool:
+        self._start()
+        if document is not None:
+            outgoing = [_Outgoing(chatId, "\n".join(texts), replyTo, kwargs, document)]
+        elif editMessageId is not None:
+            outgoing = [_Outgoing(chatId, texts[0][:MAX_MESSAGE_LENGTH], None, kwargs, editMessageId=editMessageId)]
+        else:
+            outgoing = [_Outgoing(chatId, text, replyTo, kwargs) for text in coalesce(texts)]
+        queue = self._pending.setdefault(chatId, deque())
+        idle = len(queue) == 0
+        queue.extend(outgoing)
+        self._depth += len(outgoing)
+        if idle:
+            self._ready.put_nowait(chatId)
+        results = await asyncio.gather(*[item.future for item in outgoing])
+        return all(results)
+
+    async def reply(self, message:telebot.types.Message, replies:List[str], **kwargs) -> bool:
+        return await self._enqueue(message.chat.id, replies, message, kwargs)
+
+    async def send(self, chatId:int, texts:List[str], **kwargs) -> bool:
+        return await self._enqueue(chatId, texts, None, kwargs)
+
+    async def edit(self, chatId:int, messageId:int, text:str, **kwargs) -> bool:
+        return await self._enqueue(chatId, [text], None, kwargs, editMessageId=messageId)
+
+    async def replyDocument(self, message:telebot.types.Message, filename:str, data:bytes, caption:str="", **kwargs) -> bool:
+        return await self._enqueue(message.chat.id, [caption], message, kwargs, (filename, data))
+
+    def _requeue(self, chatId:int, delay:float) -> None:
+        asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chatId)
+
+    async def _work(self) -> None:
+        while True:
+            chatId = await self._ready.get()
+            queue = self._pending.get(chatId)
+            if not queue:
+                self._pending.pop(chatId, None)
+                continue
+            wait = self._pausedUntil.get(chatId, 0) - time.monotonic()
+            if wait <= 0:
+                wait = self._chatBucket(chatId).take()
+            if wait > 0:
+                self._requeue(chatId, wait)
+                continue
+            self._pausedUntil.pop(chatId, None)
+            item = queue[0]
+            await self._global.acquire()
+            try:
+                await self._deliver(item)
+            except ApiTelegramException as e:
+                retryAfter = (e.result_json.get("parameters") or {}).get("retry_after")
+                if e.error_code == 429 and retryAfter is not None and item.retries < self.MAX_RETRIES:
+                    item.retries += 1
+                    self._throttled += 1
+                    self._logger.info(f"flood limit reached for chat {chatId}, retrying after {retryAfter}s")
+                    self._pausedUntil[chatId] = time.monotonic() + retryAfter
+                    self._requeue(chatId, retryAfter)
+                    continue
+                if e.error_code == 400 and "message is not modified" in e.description:
+                    # the edit asked for what is already shown
+                    self._finish(queue, item, True)
+                else:
+                    self._finish(queue, item, False)
+                    self._logger.error(f"failed to send message to chat {chatId}: {e}", extra={"chat": chatId})
+            except Exception as e:
+                self._finish(queue, item, False)
+                self._logger.error(f"failed to send message to chat {chatId}: {e}", extra={"chat": chatId})
+            else:
+                self._finish(queue, item, True)
+            if queue:
+                self._ready.put_nowait(chatId)
+            else:
+                self._pending.pop(chatId, None)
+
+    async def _deliver(self, item:_Outgoing) -> None:
+        if item.document is not None:
+            await self._deliverDocument(item)
+        elif item.editMessageId is not None:
+            await self._deliverEdit(item)
+        else:
+            await self._deliverMessage(item)
+
+    @_METRICS.timed("bot_send", "latency of Telegram API send calls", method="sendMessage")
+    async def _deliverMessage(self, item:_Outgoing) -> None:
+        if item.replyTo is not None:
+            await self._bot.reply_to(item.replyTo, item.text, **item.kwargs)
+        else:
+            await self._bot.send_message(item.chatId, item.text, **item.kwargs)
+
+    @_METRICS.timed("bot_send", "latency of Telegram API send calls", method="editMessageText")
+    async def _deliverEdit(self, item:_Outgoing) -> None:
+        await self._bot.edit_message_text(item.text, item.chatId, item.editMessageId, **item.kwargs)
+
+    @_METRICS.timed("bot_send", "latency of Telegram API send calls", method="sendDocument")
+    async def _deliverDocument(self, item:_Outgoing) -> None:
+        filename, data = item.document
+        replyParameters = None
+        if item.replyTo is not None:
+            replyParameters = telebot.types.ReplyParameters(item.replyTo.message_id)
+        # a fresh file object for every attempt, since a failed upload consumes it
+        await self._bot.send_document(item.chatId, telebot.types.InputFile(io.BytesIO(data), filename),
+                                      caption=item.text or None, reply_parameters=replyParameters, **item.kwargs)
+
+    def _finish(self, queue:Deque[_Outgoing], item:_Outgoing, sent:bool) -> None:
+        queue.popleft()
+        self._depth -= 1
+        if sent:
+            _METRICS.observe("bot_send_queue_seconds", time.monotonic() - item.enqueued, "time from enqueue to delivery")
+        else:
+            _METRICS.inc("bot_send_failed_total", help="messages given up on after retries")
+        if not item.future.done():
+            item.future.set_result(sent)
+
 class SingletonService(Singleton):
+    # seconds between checks of the .env file for changed admins
+    CONFIG_POLL_INTERVAL = 5.0
+    # seconds a getUpdates request waits for new updates
+    POLL_TIMEOUT = 20
+    POLL_ERROR_DELAY = 0.25
+    POLL_MAX_ERROR_DELAY = 30.0
+    ACKNOWLEDGE_TIMEOUT = 5
 
-    def __init__(self, token:str, logger:logging.Logger) -> None:
-        self._token = token
+    def __init__(self, config:Config, logger:logging.Logger) -> None:
+        self._config = config
+        self._token = config.token
         self._logger = logger
-        self._telebot = AsyncTeleBot(token)
+        self._telebot = AsyncTeleBot(config.token)
+        self._sender = SendScheduler(self._telebot, logger, config.sendGlobalRate, config.sendChatRate,
+                                     config.sendChatBurst, config.sendWorkers)
+        broadcast.setup(self._sender.send, logger, config.broadcastWorkers)
+        reminders.setup(self._sender.send, logger, config.reminderLead * 3600)
+        audit.setup(logger, config.auditRetention * 24 * 3600)
+        linkhealth.setup(self._sender.send, logger, config.linkCheckUrl, config.linkCheckInterval * 3600, config.linkCheckTtl * 3600,
+                         config.linkCheckConcurrency, config.linkCheckHostDelay)
+        self._updateTasks: Set[asyncio.Task] = set()
+        # the last update dispatched for each chat, which the next update of the chat waits for
+        self._lanes: Dict[int, asyncio.Task] = {}
+        self._updateLimit = asyncio.Semaphore(config.webhookConcurrency)
+        # the id after the last update received by polling
+        self._offset: Optional[int] = None
+        self._stopping: asyncio.Event = None
+        self._telebot.setup_middleware(FloodMiddleware(
+            self._telebot, self._sender.reply, logger, config.floodLimit, config.floodCommandLimits, config.floodWindow,
+            # only the admin role may manage roles, so this exempts the administrators and not every role holder
+            lambda username: getDatabase().hasPermission(username, rbac.ROLES), config.floodInteractiveLimit,
+        ))
         self._addHandlers()
 
     def run(self):
-        asyncio.run(self._telebot.polling())
+        asyncio.run(self.serve())
+
+    def _handleSignals(self) -> None:
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self._stop, signum)
+            except (NotImplementedError, RuntimeError):
+                # not supported on Windows, nor outside the main thread
+                pass
+
+    def _stop(self, signum:int) -> None:
+        self._logger.info(f"received {signal.Signals(signum).name}, shutting down", extra=monitoring.STATUS)
+        self._stopping.set()
+
+    async def serve(self, receive:Optional[Callable[[], Awaitable[None]]]=None, primary:bool=True) -> None:
+        """
+        Receives and handles updates until cancelled or sent SIGTERM or SIGINT.
+        Then stops receiving, waits up to shutdownTimeout seconds for the updates in flight
+        and flushes the database before returning.
+        A worker process passes the coroutine function that receives its updates as receive and
+        is stopped by its return instead of signals. Only the primary process prunes the audit
+        trail, sends reminders and checks invite links.
+        """
+        metricsRunner = None
+        if self._config.metricsPort:
+            metricsRunner = await startMetricsServer(self._config.metricsHost, self._config.metricsPort)
+            self._logger.info(f"metrics served on {self._config.metricsHost}:{self._config.metricsPort}/metrics")
+        if self._config.opsChatId is not None:
+            await monitoring.getShipper().start(self._sender.send, self._config.opsChatId, self._config.opsDigestInterval)
+        if primary:
+            await audit.getAuditTrail().start()
+        await broadcast.getBroadcaster().resume(primary)
+        await reminders.getReminderScheduler().start(deliver=primary)
+        await linkhealth.getLinkChecker().start(periodic=primary)
+        watcher = asyncio.create_task(self._watchConfig())
+        self._stopping = asyncio.Event()
+        if receive is not None:
+            server = asyncio.create_task(receive())
+        elif self._config.mode == "webhook":
+            self._handleSignals()
+            server = asyncio.create_task(self._serveWebhook())
+        else:
+            self._handleSignals()
+            server = asyncio.create_task(self._poll())
+        stopping = asyncio.ensure_future(self._stopping.wait())
+        try:
+            await asyncio.wait([server, stopping], return_when=asyncio.FIRST_COMPLETED)
+            if server.done():
+                server.result()
+        finally:
+            stopping.cancel()
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+            await self._drain()
+            watcher.cancel()
+            await broadcast.getBroadcaster().stop()
+            await reminders.getReminderScheduler().stop()
+            await linkhealth.getLinkChecker().stop()
+            await audit.getAuditTrail().stop()
+            if metricsRunner is not None:
+                await metricsRunner.cleanup()
+            if self._config.opsChatId is not None:
+                await monitoring.getShipper().stop()
+            await getAsyncDatabase().close()
+            if self._offset is not None:
+                await self._acknowledge()
+            await self._telebot.close_session()
+            self._logger.info("stopped")
+
+    async def _poll(self) -> None:
+        """
+        Long polls for updates like telebot's polling, but keeps the task of every batch so that
+        the updates in flight can be drained on shutdown.
+        """
+        self._logger.info("polling for updates", extra=monitoring.STATUS)
+        delay = self.POLL_ERROR_DELAY
+        webhookDeleted = False
+        while True:
+            try:
+                if not webhookDeleted:
+                    # a webhook left by an earlier run in webhook mode makes getUpdates fail with 409 Conflict
+                    await self._telebot.delete_webhook()
+                    webhookDeleted = True
+                updates = await self._telebot.get_updates(offset=self._offset, timeout=self.POLL_TIMEOUT)
+            except Exception as e:
+                self._logger.error(f"failed to get updates: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.POLL_MAX_ERROR_DELAY)
+                continue
+            delay = self.POLL_ERROR_DELAY
+            if updates:
+                self._offset = updates[-1].update_id + 1
+                self._track(self._processUpdates(updates))
+
+    async def _acknowledge(self) -> None:
+        # the updates handled since the last getUpdates are only confirmed by the next one,
+        # otherwise Telegram sends them again after a restart
+        try:
+            await self._telebot.get_updates(offset=self._offset, limit=1, timeout=0, request_timeout=self.ACKNOWLEDGE_TIMEOUT)
+        except Exception as e:
+            self._logger.error(f"failed to acknowledge the updates handled: {e}")
+
+    def _track(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._updateTasks.add(task)
+        task.add_done_callback(self._updateTasks.discard)
+        return task
+
+    def dispatch(self, chatId:int, update:telebot.types.Update) -> None:
+        """
+        Handles update after the updates of the same chat dispatched before it, while the updates of
+        other chats are handled concurrently.
+        """
+        previous = self._lanes.get(chatId)
+        task = self._track(self._processAfter(previous, update))
+        self._lanes[chatId] = task
+        task.add_done_callback(lambda _: self._lanes.pop(chatId, None) if self._lanes.get(chatId) is task else None)
+
+    async def _processAfter(self, previous:Optional[asyncio.Task], update:telebot.types.Update) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        await self._processUpdates([update])
+
+    async def _drain(self) -> None:
+        if not self._updateTasks:
+            return
+        self._logger.info(f"waiting for {len(self._updateTasks)} update batches in flight")
+        _, pending = await asyncio.wait(set(self._updateTasks), timeout=self._config.shutdownTimeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            self._logger.error(f"cancelled {len(pending)} update batches still in flight after {self._config.shutdownTimeout}s")
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _watchConfig(self) -> None:
+        """
+        Applies changes of ADMINS in the .env file without a restart. Other settings still need one.
+        """
+        def modified() -> Optional[float]:
+            try:
+                return os.stat(ENV_FILE).st_mtime
+            except OSError:
+                return None
+        seen = modified()
+        while True:
+            await asyncio.sleep(self.CONFIG_POLL_INTERVAL)
+            current = modified()
+            if current is None or current == seen:
+                continue
+            seen = current
+            try:
+                config = readConfig()
+            except ConfigException as e:
+                self._logger.error(f"ignored the changed {ENV_FILE}: {e}")
+                continue
+            if config.admins != getDatabase().getAdmins():
+                getDatabase().setAdmins(config.admins)
+                self._logger.info(f"reloaded admins from {ENV_FILE}: {', '.join(config.admins)}")
+
+    def _webhookApp(self) -> web.Application:
+        app = web.Application()
+        path = urlparse(self._config.webhookUrl).path or "/"
+        app.router.add_post(path, self._handleWebhook)
+        return app
+
+    async def _serveWebhook(self) -> None:
+        runner = web.AppRunner(self._webhookApp())
+        await runner.setup()
+        site = web.TCPSite(runner, self._config.webhookHost, self._config.webhookPort)
+        await site.start()
+        await self._telebot.set_webhook(url=self._config.webhookUrl, secret_token=self._config.webhookSecret)
+        self._logger.info(f"webhook listening on {self._config.webhookHost}:{self._config.webhookPort}", extra=monitoring.STATUS)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    async def _handleWebhook(self, request:web.Request) -> web.Response:
+        secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        # compared as bytes, compare_digest rejects str with non-ASCII characters, which aiohttp may decode with surrogates
+        if not hmac.compare_digest(secret.encode("utf-8", "surrogateescape"), self._config.webhookSecret.encode()):
+            self._logger.error("webhook request rejected because of a bad secret token")
+            return web.Response(status=403)
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(body, dict) or "update_id" not in body:
+            return web.Response(status=400)
+        update = telebot.types.Update.de_json(body)
+        # acknowledge at once so that Telegram does not retry while the update is handled
+        self._track(self._processUpdates([update]))
+        return web.Response()
+
+    async def _processUpdates(self, updates:List[telebot.types.Update]) -> None:
+        async with self._updateLimit:
+            try:
+                await self._telebot.process_new_updates(updates)
+            except Exception as e:
+                self._logger.error(f"failed to process updates {updates[0].update_id} to {updates[-1].update_id}: {e}")
 
     def _addHandlers(self):
         @self._telebot.message_handler(commands=['start','welcome'])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="welcome")
         async def welcome(message:telebot.types.Message) -> None:
             """
             /start      Says hi to user
             /welcome    Says hi to user
             """
             replies = User(message.from_user.username, message.from_user.full_name, self._logger).welcome(message)
-            for reply in replies:
-                await self._telebot.reply_to(message, reply)
+            await self._sender.reply(message, replies)
 
         @self._telebot.message_handler(commands=['get'])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="get")
         async def get(message:telebot.types.Message) -> None:
             """
             /get all            return all telegram invitation links
             /get [unitCode]     return telegram invitation link for a specific unit
             """
-            replies = User(message.from_user.username, message.from_user.full_name, self._logger).get(message)
-            for reply in replies:
-                await self._telebot.reply_to(message, reply)
+            user = User(message.from_user.username, message.from_user.full_name, self._logger)
+            tokens = message.text.split()
+            if self._config.getAll == "pages" and len(tokens) > 1 and tokens[1].upper() == "ALL":
+                text, markup = await user.browse()
+                await self._sender.reply(message, [text], reply_markup=markup)
+            else:
+                replies = await user.get(message)
+                await self._sender.reply(message, replies)
+
+        @self._telebot.callback_query_handler(func=lambda call: (call.data or "").startswith(f"{BROWSE}:"))
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="browse")
+        async def browse(call:telebot.types.CallbackQuery) -> None:
+            """
+            moves the /get all message to the page or prefix chosen on its inline keyboard
+            """
+            await self._telebot.answer_callback_query(call.id)
+            action = call.data[len(BROWSE) + 1:]
+            if action == "noop" or call.message is None:
+                return
+            user = User(call.from_user.username, call.from_user.full_name, self._logger)
+            if action.startswith("prefix:"):
+                text, markup = await user.browse(prefix=action[len("prefix:"):])
+            elif action.isdigit():
+                text, markup = await user.browse(page=int(action))
+            else:
+                return
+            await self._sender.edit(call.message.chat.id, call.message.message_id, text, reply_markup=markup)
+
+        @self._telebot.message_handler(commands=['search'])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="search")
+        async def search(message:telebot.types.Message) -> None:
+            """
+            /search [text]      return the telegram groups whose unit code or name best match the text
+            """
+            replies = User(message.from_user.username, message.from_user.full_name, self._logger).search(message)
+            await self._sender.reply(message, replies)
+
+        @self._telebot.inline_handler(func=lambda query: True)
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="inline")
+        async def inline(query:telebot.types.InlineQuery) -> None:
+            """
+            @bot [text]         return the telegram groups whose unit code or name words start with the text
+            """
+            results, nextOffset = User(query.from_user.username, query.from_user.full_name, self._logger).inline(query.query, query.offset)
+            # the results are the same for every user, so Telegram may serve repeated queries from its cache
+            await self._telebot.answer_inline_query(query.id, results, cache_time=self._config.inlineCacheTime,
+                                                    is_personal=False, next_offset=nextOffset)
+
+        @self._telebot.message_handler(commands=['subscribe'])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="subscribe")
+        async def subscribe(message:telebot.types.Message) -> None:
+            """
+            /subscribe [unit code]      get reminders of the deadlines of a unit
+            """
+            replies = await User(message.from_user.username, message.from_user.full_name, self._logger).subscribe(message)
+            await self._sender.reply(message, replies)
+
+        @self._telebot.message_handler(commands=['unsubscribe'])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="unsubscribe")
+        async def unsubscribe(message:telebot.types.Message) -> None:
+            """
+            /unsubscribe [unit code]    stop the reminders of the deadlines of a unit
+            """
+            replies = await User(message.from_user.username, message.from_user.full_name, self._logger).unsubscribe(message)
+            await self._sender.reply(message, replies)
 
         @self._telebot.message_handler(commands=['admins'])
-        async def adminlist( message:telebot.types.Message) -> None:
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="admins")
+        async def adminlist(message:telebot.types.Message) -> None:
             """
             /admins             retrieve the list of administrators
             """
             replies = User(message.from_user.username, message.from_user.full_name, self._logger).adminlist(message)
-            for reply in replies:
-                await self._telebot.reply_to(message, reply)
+            await self._sender.reply(message, replies)
         
         @self._telebot.message_handler(commands=["help"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="help")
         async def help(message:telebot.types.Message) -> None:
             """
             /help               displays all available commands to the user
             """
             replies = User(message.from_user.username, message.from_user.full_name, self._logger).help(message)
-            for reply in replies:
-                await self._telebot.reply_to(message, reply)
             try:
-                replies = Admin(message.from_user.username, message.from_user.full_name, self._logger).help(message)
+                replies += Admin(message.from_user.username, message.from_user.full_name, self._logger).help(message)
             except NonAdminUserException:
                 pass
-            else:
-                for reply in replies:
-                    await self._telebot.reply_to(message, reply)
+            await self._sender.reply(message, replies)
 
         @self._telebot.message_handler(commands=["add"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="add")
         async def add(message:telebot.types.Message) -> None:
             """
             /add [unit code] ] [link] [title]       add a telegram group
             """
             try:
-                replies = Admin(message.from_user.username, message.from_user.full_name, self._logger).add(message)
+                replies = await Admin(message.from_user.username, message.from_user.full_name, self._logger).add(message)
             except NonAdminUserException:
                 self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /add.")
-                await self._telebot.reply_to(message, "Fail. You are not authorised to perform /add.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /add."])
             else:
-                for reply in replies:
-                    await self._telebot.reply_to(message, reply)
+                await self._sender.reply(message, replies)
 
         @self._telebot.message_handler(commands=["update"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="update")
         async def update(message:telebot.types.Message) -> None:
             """
             /update [unit code] link [new link]         update the telegram link for an academic unit
             /update [unit code] name [new unit name]    update the name of the academic unit
             """
             try:
-                replies = Admin(message.from_user.username, message.from_user.full_name, self._logger).update(message)
+                replies = await Admin(message.from_user.username, message.from_user.full_name, self._logger).update(message)
             except NonAdminUserException:
                 self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /update.")
-                await self._telebot.reply_to(message, "Fail. You are not authorised to perform /update.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /update."])
             else:
-                for reply in replies:
-                    await self._telebot.reply_to(message, reply)
+                await self._sender.reply(message, replies)
 
         @self._telebot.message_handler(commands=["rm"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="rm")
         async def remove(message:telebot.types.Message) -> None:
             """
             /rm [unitCode]      removes a telegram group for that unit code.
             """
             try:
-                replies = Admin(message.from_user.username, message.from_user.full_name, self._logger).remove(message)
+                replies = await Admin(message.from_user.username, message.from_user.full_name, self._logger).remove(message)
             except NonAdminUserException:
                 self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /rm.")
-                await self._telebot.reply_to(message, "Fail. You are not authorised to perform /rm.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /rm."])
+            else:
+                await self._sender.reply(message, replies)
+
+        @self._telebot.message_handler(commands=["stats"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="stats")
+        async def stats(message:telebot.types.Message) -> None:
+            """
+            /stats              display command, database and send latency statistics
+            """
+            try:
+                replies = Admin(message.from_user.username, message.from_user.full_name, self._logger).stats(message)
+            except NonAdminUserException:
+                self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /stats.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /stats."])
+            else:
+                await self._sender.reply(message, replies)
+
+        @self._telebot.message_handler(commands=["register"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="register")
+        async def register(message:telebot.types.Message) -> None:
+            """
+            /register [unit code]       register the telegram group this is sent in for broadcasts
+            """
+            try:
+                replies = await Admin(message.from_user.username, message.from_user.full_name, self._logger).register(message)
+            except NonAdminUserException:
+                self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /register.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /register."])
+            else:
+                await self._sender.reply(message, replies)
+
+        @self._telebot.message_handler(commands=["broadcast"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="broadcast")
+        async def broadcastMessage(message:telebot.types.Message) -> None:
+            """
+            /broadcast [all or prefix] [message]    send a message to the registered telegram groups
+            """
+            try:
+                replies = await Admin(message.from_user.username, message.from_user.full_name, self._logger).broadcast(message)
+            except NonAdminUserException:
+                self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /broadcast.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /broadcast."])
+            else:
+                await self._sender.reply(message, replies)
+
+        @self._telebot.message_handler(commands=["remind"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="remind")
+        async def remind(message:telebot.types.Message) -> None:
+            """
+            /remind [unit code] [date] [time] [deadline]    remind the subscribers of a unit of a deadline
+            """
+            try:
+                replies = await Admin(message.from_user.username, message.from_user.full_name, self._logger).remind(message)
+            except NonAdminUserException:
+                self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /remind.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /remind."])
+            else:
+                await self._sender.reply(message, replies)
+
+        @self._telebot.message_handler(commands=["health"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="health")
+        async def health(message:telebot.types.Message) -> None:
+            """
+            /health [check]     display the invite links found expired or revoked
+            """
+            try:
+                replies = await Admin(message.from_user.username, message.from_user.full_name, self._logger).health(message)
+            except NonAdminUserException:
+                self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /health.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /health."])
             else:
-                for reply in replies:
-                    await self._telebot.reply_to(message, reply)
+                await self._sender.reply(message, replies)
 
+        @self._telebot.message_handler(commands=["grant"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="grant")
+        async def grant(message:telebot.types.Message) -> None:
+            """
+            /grant [username] [role]       grant a role to a user
+            """
+            try:
+                replies = await Admin(message.from_user.username, message.from_user.full_name, self._logger).grant(message)
+            except NonAdminUserException:
+                self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /grant.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /grant."])
+            else:
+                await self._sender.reply(message, replies)
+
+        @self._telebot.message_handler(commands=["revoke"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="revoke")
+        async def revoke(message:telebot.types.Message) -> None:
+            """
+            /revoke [username] [role]      revoke a role from a user
+            """
+            try:
+                replies = await Admin(message.from_user.username, message.from_user.full_name, self._logger).revoke(message)
+            except NonAdminUserException:
+                self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /revoke.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /revoke."])
+            else:
+                await self._sender.reply(message, replies)
+
+        @self._telebot.message_handler(commands=["roles"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="roles")
+        async def roles(message:telebot.types.Message) -> None:
+            """
+            /roles [username]              display the roles of a user or of all users
+            """
+            try:
+                replies = Admin(message.from_user.username, message.from_user.full_name, self._logger).roles(message)
+            except NonAdminUserException:
+                self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /roles.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /roles."])
+            else:
+                await self._sender.reply(message, replies)
+
+        async def importDocument(message:telebot.types.Message, document:telebot.types.Document) -> None:
+            try:
+                admin = Admin(message.from_user.username, message.from_user.full_name, self._logger)
+                admin.require(rbac.IMPORT)
+            except NonAdminUserException:
+                self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /import.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /import."])
+                return
+            if document.file_size is not None and document.file_size > MAX_DOWNLOAD_SIZE:
+                await self._sender.reply(message, [f"Fail because {document.file_name} is larger than 20 MB."])
+                return
+            fileInfo = await self._telebot.get_file(document.file_id)
+            data = await self._telebot.download_file(fileInfo.file_path)
+            replies = await admin.importGroups(message, document.file_name or "", data)
+            await self._sender.reply(message, replies)
+
+        # extract_command drops the @botname that commands carry in groups, as the commands filter does
+        @self._telebot.message_handler(content_types=["document"],
+                                       func=lambda message: telebot.util.extract_command(message.caption) == "import")
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="import")
+        async def importCaption(message:telebot.types.Message) -> None:
+            """
+            /import             as the caption of a CSV or JSON document, add the telegram groups in it
+            """
+            await importDocument(message, message.document)
+
+        @self._telebot.message_handler(commands=["import"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="import")
+        async def importReply(message:telebot.types.Message) -> None:
+            """
+            /import             in reply to a CSV or JSON document, add the telegram groups in it
+            """
+            original = message.reply_to_message
+            if original is None or original.document is None:
+                await self._sender.reply(message, ["Fail because no document is given. Send a CSV or JSON document with /import as its caption."])
+                return
+            await importDocument(message, original.document)
+
+        @self._telebot.message_handler(commands=["export"])
+        @_METRICS.timed("bot_handler", "latency of command handlers", command="export")
+        async def export(message:telebot.types.Message) -> None:
+            """
+            /export             return all telegram groups as a CSV document
+            """
+            try:
+                data = await Admin(message.from_user.username, message.from_user.full_name, self._logger).exportGroups(message)
+            except NonAdminUserException:
+                self._logger.error(f"Non-admin user {message.from_user.username} attempted to use /export.")
+                await self._sender.reply(message, ["Fail. You are not authorised to perform /export."])
+            else:
+                await self._sender.replyDocument(message, "telegram_groups.csv", data)
@@ -0,0 +1,299 @@
+from typing import Any, Iterable, Iterator, List, Tuple
+
+import os
+import json
+import shelve
+import sqlite3
+import threading
+
+class UnknownBackendException(Exception):
+    def __init__(self, backend:str) -> None:
+        super().__init__(f"{backend} is not a known storage backend")
+
+class StorageBackend:
+    """
+    Key-value store of telegram groups. Each unit code maps to a (unit name, link) tuple.
+    Other state of the bot is kept beside the groups as JSON values under a namespace and a key.
+    Backends must be safe to call from several threads.
+    """
+    def get(self, unitCode:str) -> Tuple[str, str]:
+        raise NotImplementedError()
+
+    def put(self, unitCode:str, unitName:str, link:str) -> None:
+        raise NotImplementedError()
+
+    def putMany(self, rows:Iterable[Tuple[str, str, str]]) -> int:
+        count = 0
+        for unitCode, unitName, link in rows:
+            self.put(unitCode, unitName, link)
+            count += 1
+        return count
+
+    def delete(self, unitCode:str) -> None:
+        raise NotImplementedError()
+
+    def items(self) -> Iterator[Tuple[str, str, str]]:
+        raise NotImplementedError()
+
+    def __contains__(self, unitCode:str) -> bool:
+        try:
+            self.get(unitCode)
+        except KeyError:
+            return False
+        return True
+
+    def getValue(self, namespace:str, key:str) -> Any:
+        raise NotImplementedError()
+
+    def putValue(self, namespace:str, key:str, value:Any) -> None:
+        raise NotImplementedError()
+
+    def deleteValue(self, namespace:str, key:str) -> None:
+        raise NotImplementedError()
+
+    def values(self, namespace:str) -> Iterator[Tuple[str, Any]]:
+        raise NotImplementedError()
+
+    def namespaces(self) -> List[str]:
+        raise NotImplementedError()
+
+    def sync(self) -> None:
+        """
+        Makes every write so far durable.
+        """
+        pass
+
+    def close(self) -> None:
+        pass
+
+def _fsync(path:str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class ShelveBackend(StorageBackend):
+    # values share the shelf with the groups under "namespace:key", which is never a unit code
+    SEPARATOR = ":"
+    # files the dbm modules may keep the shelf in
+    SUFFIXES = ("", ".db", ".dat", ".dir", ".pag")
+
+    def __init__(self, dbname:str, flag:str="c") -> None:
+        self._dbname = dbname
+        self._db = shelve.open(dbname, flag=flag)
+        # dbm modules are not thread safe
+        self._lock = threading.RLock()
+
+    def get(self, unitCode:str) -> Tuple[str, str]:
+        with self._lock:
+            unitName, link = self._db[unitCode]
+        return unitName, link
+
+    def put(self, unitCode:str, unitName:str, link:str) -> None:
+        with self._lock:
+            self._db[unitCode] = (unitName, link)
+
+    def delete(self, unitCode:str) -> None:
+        with self._lock:
+            del self._db[unitCode]
+
+    def items(self) -> Iterator[Tuple[str, str, str]]:
+        with self._lock:
+            rows = [(unitCode, *self._db[unitCode]) for unitCode in self._db if self.SEPARATOR not in unitCode]
+        return iter(rows)
+
+    def __contains__(self, unitCode:str) -> bool:
+        with self._lock:
+            return unitCode in self._db
+
+    def getValue(self, namespace:str, key:str) -> Any:
+        with self._lock:
+            return self._db[f"{namespace}{self.SEPARATOR}{key}"]
+
+    def putValue(self, namespace:str, key:str, value:Any) -> None:
+        with self._lock:
+            self._db[f"{namespace}{self.SEPARATOR}{key}"] = value
+
+    def deleteValue(self, namespace:str, key:str) -> None:
+        with self._lock:
+            del self._db[f"{namespace}{self.SEPARATOR}{key}"]
+
+    def values(self, namespace:str) -> Iterator[Tuple[str, Any]]:
+        start = namespace + self.SEPARATOR
+        with self._lock:
+            rows = [(name[len(start):], self._db[name]) for name in self._db if name.startswith(start)]
+        return iter(sorted(rows, key=lambda row: row[0]))
+
+    def namespaces(self) -> List[str]:
+        with self._lock:
+            return sorted({name.split(self.SEPARATOR, 1)[0] for name in self._db if self.SEPARATOR in name})
+
+    def sync(self) -> None:
+        with self._lock:
+            self._db.sync()
+            # not every dbm module fsyncs on sync
+            for suffix in self.SUFFIXES:
+                _fsync(self._dbname + suffix)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+class SQLiteBackend(StorageBackend):
+    _SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS telegram_groups (
+            unit_code TEXT PRIMARY KEY,
+            prefix TEXT NOT NULL,
+            unit_name TEXT NOT NULL,
+            link TEXT NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS telegram_groups_prefix ON telegram_groups (prefix, unit_code)",
+        """
+        CREATE TABLE IF NOT EXISTS kv (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID
+        """,
+    ]
+    # statements are kept constant and parameterised so sqlite3 reuses the prepared statements
+    _GET = "SELECT unit_name, link FROM telegram_groups WHERE unit_code = ?"
+    _PUT = "INSERT OR REPLACE INTO telegram_groups (unit_code, prefix, unit_name, link) VALUES (?, ?, ?, ?)"
+    _DELETE = "DELETE FROM telegram_groups WHERE unit_code = ?"
+    _ITEMS = "SELECT unit_code, unit_name, link FROM telegram_groups ORDER BY unit_code"
+    _GET_VALUE = "SELECT value FROM kv WHERE namespace = ? AND key = ?"
+    _PUT_VALUE = "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)"
+    _DELETE_VALUE = "DELETE FROM kv WHERE namespace = ? AND key = ?"
+    _VALUES = "SELECT key, value FROM kv WHERE namespace = ? ORDER BY key"
+    _NAMESPACES = "SELECT DISTINCT namespace FROM kv ORDER BY namespace"
+
+    def __init__(self, dbname:str, durable:bool=False) -> None:
+        self._dbname = dbname
+        # a durable store fsyncs the WAL on every commit, otherwise only sync makes the commits durable
+        self._durable = durable
+        # every thread gets its own connection so that WAL readers never wait on each other
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in self._SCHEMA:
+            conn.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._dbname, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=FULL" if self._durable else "PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def get(self, unitCode:str) -> Tuple[str, str]:
+        row = self._connection().execute(self._GET, (unitCode,)).fetchone()
+        if row is None:
+            raise KeyError(unitCode)
+        return row[0], row[1]
+
+    def put(self, unitCode:str, unitName:str, link:str) -> None:
+        self._connection().execute(self._PUT, (unitCode, unitCode[:3], unitName, link))
+
+    def putMany(self, rows:Iterable[Tuple[str, str, str]]) -> int:
+        conn = self._connection()
+        count = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for unitCode, unitName, link in rows:
+                conn.execute(self._PUT, (unitCode, unitCode[:3], unitName, link))
+                count += 1
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return count
+
+    def delete(self, unitCode:str) -> None:
+        cursor = self._connection().execute(self._DELETE, (unitCode,))
+        if cursor.rowcount == 0:
+            raise KeyError(unitCode)
+
+    def items(self) -> Iterator[Tuple[str, str, str]]:
+        for unitCode, unitName, link in self._connection().execute(self._ITEMS):
+            yield unitCode, unitName, link
+
+    def getValue(self, namespace:str, key:str) -> Any:
+        row = self._connection().execute(self._GET_VALUE, (namespace, key)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def putValue(self, namespace:str, key:str, value:Any) -> None:
+        self._connection().execute(self._PUT_VALUE, (namespace, key, json.dumps(value)))
+
+    def deleteValue(self, namespace:str, key:str) -> None:
+        cursor = self._connection().execute(self._DELETE_VALUE, (namespace, key))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def values(self, namespace:str) -> Iterator[Tuple[str, Any]]:
+        for key, value in self._connection().execute(self._VALUES, (namespace,)):
+            yield key, json.loads(value)
+
+    def namespaces(self) -> List[str]:
+        return [row[0] for row in self._connection().execute(self._NAMESPACES)]
+
+    def sync(self) -> None:
+        if self._durable:
+            # every commit is durable already, and SQLite checkpoints the WAL as it grows
+            return
+        # a passive checkpoint waits for no reader or writer, the frames it leaves in the WAL are made durable there
+        _, frames, checkpointed = self._connection().execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        if checkpointed < frames:
+            _fsync(self._dbname + "-wal")
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns = []
+        self._local = threading.local()
+
+_BACKENDS = {
+    "shelve": ShelveBackend,
+    "sqlite": SQLiteBackend,
+}
+
+def openBackend(backend:str, dbname:str, durable:bool=False) -> StorageBackend:
+    """
+    Opens the store dbname with backend. A durable store makes each write durable as it is committed
+    where the backend can, so that sync has little left to do.
+    """
+    try:
+        cls = _BACKENDS[backend.lower()]
+    except KeyError:
+        raise UnknownBackendException(backend)
+    if cls is SQLiteBackend:
+        return cls(dbname, durable)
+    return cls(dbname)
+
+def migrateShelveToSQLite(shelveName:str, sqliteName:str) -> int:
+    source = ShelveBackend(shelveName, flag="r")
+    target = SQLiteBackend(sqliteName)
+    try:
+        count = target.putMany(source.items())
+        for namespace in source.namespaces():
+            for key, value in source.values(namespace):
+                target.putValue(namespace, key, value)
+        return count
+    finally:
+        source.close()
+        target.close()
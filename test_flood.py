@@ -0,0 +1,90 @@
+import random
+import unittest
+
+from flood import SlidingWindowLimiter
+
+WINDOW = 60.0
+
+class Clock:
+    def __init__(self, now:float) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+class SlidingWindowLimiterTest(unittest.TestCase):
+    """
+    Drives the limiter with a clock of its own and checks that a refused user is allowed again
+    once the wait it was told has passed, and not before.
+    """
+    def setUp(self) -> None:
+        # 50 seconds into a window
+        self.clock = Clock(1000 * WINDOW + 50)
+        self.limiter = SlidingWindowLimiter(WINDOW, clock=self.clock)
+
+    def hit(self, limit:int, key:str="*") -> float:
+        wait, _ = self.limiter.hit([((1, key), limit)])
+        return wait
+
+    def assertWaitHonoured(self, limit:int, wait:float) -> None:
+        self.assertGreater(wait, 0)
+        if wait > 0.01:
+            self.clock.now += wait - 0.01
+            self.assertGreater(self.hit(limit), 0)
+            self.clock.now += 0.01
+        else:
+            self.clock.now += wait
+        self.clock.now += 1e-6
+        self.assertEqual(self.hit(limit), 0)
+
+    def testLimitIsAllowed(self) -> None:
+        for _ in range(5):
+            self.assertEqual(self.hit(5), 0)
+        self.assertGreater(self.hit(5), 0)
+
+    def testWaitOverTheLimitLateInTheWindow(self) -> None:
+        for _ in range(5):
+            self.hit(5)
+        wait = self.hit(5)
+        # the count of this window is still weighted in the next one
+        self.assertAlmostEqual(wait, 10 + WINDOW / 5)
+        self.assertWaitHonoured(5, wait)
+
+    def testWaitForThePreviousWindowToFade(self) -> None:
+        for _ in range(5):
+            self.hit(5)
+        # 20 seconds into the next window
+        self.clock.now += 30
+        self.assertEqual(self.hit(5), 0)
+        wait = self.hit(5)
+        self.assertLess(wait, WINDOW)
+        self.assertWaitHonoured(5, wait)
+
+    def testFirstRefusalIsNoticed(self) -> None:
+        self.hit(1)
+        self.assertEqual(self.limiter.hit([((1, "*"), 1)])[1], True)
+        self.assertEqual(self.limiter.hit([((1, "*"), 1)])[1], False)
+        self.clock.now += self.limiter.hit([((1, "*"), 1)])[0] + 1e-6
+        self.assertEqual(self.limiter.hit([((1, "*"), 1)]), (0.0, False))
+
+    def testRefusedEventIsCountedForNoKey(self) -> None:
+        self.assertEqual(self.limiter.hit([((1, "get"), 1), ((1, "*"), 5)]), (0.0, False))
+        self.assertGreater(self.limiter.hit([((1, "get"), 1), ((1, "*"), 5)])[0], 0)
+        for _ in range(4):
+            self.assertEqual(self.hit(5), 0)
+
+    def testWaitIsHonouredAtRandom(self) -> None:
+        rng = random.Random(7)
+        for _ in range(500):
+            self.clock.now = 1000 * WINDOW + rng.uniform(0, WINDOW)
+            self.limiter = SlidingWindowLimiter(WINDOW, clock=self.clock)
+            limit = rng.randint(1, 10)
+            while True:
+                wait = self.hit(limit)
+                if wait > 0:
+                    break
+                self.clock.now += rng.expovariate(limit / WINDOW)
+            self.assertWaitHonoured(limit, wait)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+
+from journal import Journal, JournaledBackend, JOURNAL_SUFFIX
+from storage import SQLiteBackend
+
+class JournaledBackendTest(unittest.TestCase):
+    """
+    Crashes a journaled store by abandoning it without a checkpoint and checks what a restart recovers
+    from the journal. A crash is modelled by reopening the journal over a store that lost every write
+    since the last checkpoint.
+    """
+    def setUp(self) -> None:
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.workdir = workdir.name
+        self.journal = os.path.join(self.workdir, "database.db" + JOURNAL_SUFFIX)
+        self.opened = []
+        self.addCleanup(self.closeAll)
+
+    def closeAll(self) -> None:
+        for store in self.opened:
+            store.close()
+
+    def openStore(self, name:str, checkpoint:int=1000) -> JournaledBackend:
+        store = JournaledBackend(SQLiteBackend(os.path.join(self.workdir, name)), self.journal, checkpoint)
+        self.opened.append(store)
+        return store
+
+    def crash(self, store:JournaledBackend) -> None:
+        # the process dies, so nothing is checkpointed and the backend is left as it is
+        store._journal.close()
+        store._backend.close()
+        self.opened.remove(store)
+
+    def write(self, store:JournaledBackend) -> None:
+        store.put("ICT100", "Intro", "https://t.me/+a")
+        store.putMany([("ICT200", "Data", "https://t.me/+b"), ("ICT300", "Nets", "https://t.me/+c")])
+        store.delete("ICT200")
+        store.put("ICT100", "Intro to ICT", "https://t.me/+a")
+        store.putValue("roles", "alice", ["editor"])
+        store.putValue("roles", "bob", ["announcer"])
+        store.deleteValue("roles", "bob")
+
+    def assertRecovered(self, store:JournaledBackend) -> None:
+        self.assertEqual(list(store.items()), [("ICT100", "Intro to ICT", "https://t.me/+a"), ("ICT300", "Nets", "https://t.me/+c")])
+        self.assertEqual(list(store.values("roles")), [("alice", ["editor"])])
+
+    def testReplayAfterCrash(self) -> None:
+        store = self.openStore("lost.db")
+        self.write(store)
+        store.sync()
+        self.crash(store)
+        recovered = self.openStore("database.db")
+        self.assertEqual(recovered.replayed, 7)
+        self.assertRecovered(recovered)
+        # the replayed writes are in the backend now, so the journal starts over
+        self.assertEqual(os.path.getsize(self.journal), 0)
+
+    def testTornFinalRecordIsDropped(self) -> None:
+        self.recoverWithBadTail(b'1234abcd ["put","ICT400","Ghost","https://t.me/+')
+
+    def testCorruptFinalRecordIsDropped(self) -> None:
+        self.recoverWithBadTail(b'00000000 ["put","ICT400","Ghost","https://t.me/+d"]\n')
+
+    def recoverWithBadTail(self, tail:bytes) -> None:
+        store = self.openStore("lost.db")
+        self.write(store)
+        store.sync()
+        self.crash(store)
+        with open(self.journal, "ab") as journal:
+            journal.write(tail)
+        recovered = self.openStore("database.db")
+        self.assertEqual(recovered.replayed, 7)
+        self.assertRecovered(recovered)
+        # records appended after recovery must not end up behind the bad one
+        recovered.put("ICT500", "Later", "https://t.me/+e")
+        recovered.sync()
+        self.crash(recovered)
+        self.assertEqual([record[1] for record in Journal.read(self.journal)], ["ICT500"])
+
+    def testCheckpointTruncatesTheJournal(self) -> None:
+        store = self.openStore("database.db", checkpoint=7)
+        self.write(store)
+        store.sync()
+        self.assertEqual(os.path.getsize(self.journal), 0)
+        store.put("ICT600", "After", "https://t.me/+f")
+        store.sync()
+        self.assertEqual(len(list(Journal.read(self.journal))), 1)
+        self.crash(store)
+        # the checkpointed writes are in the backend, only the one after them is replayed
+        recovered = self.openStore("database.db")
+        self.assertEqual(recovered.replayed, 1)
+        self.assertEqual(recovered.get("ICT600"), ("After", "https://t.me/+f"))
+        self.assertEqual(recovered.get("ICT100"), ("Intro to ICT", "https://t.me/+a"))
+        self.assertNotIn("ICT200", recovered)
+
+if __name__ == "__main__":
+    unittest.main()
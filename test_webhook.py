@@ -0,0 +1,115 @@
+import os
+import json
+import asyncio
+import logging
+import tempfile
+import unittest
+
+from aiohttp.test_utils import TestClient, TestServer
+import telebot.asyncio_helper
+
+import config
+import service
+import persistence
+from benchmark import FakeBotAPI
+
+SECRET = "webhook-secret"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def command(updateId:int, text:str, chatId:int=7, username:str="alice") -> dict:
+    return {
+        "update_id": updateId,
+        "message": {
+            "message_id": updateId,
+            "date": 0,
+            "chat": {"id": chatId, "type": "private"},
+            "from": {"id": chatId, "is_bot": False, "first_name": username, "username": username},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        },
+    }
+
+class WebhookTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Posts synthetic updates to the webhook of the bot, which replies through a local stub of the Bot API.
+    """
+    async def asyncSetUp(self) -> None:
+        self.api = FakeBotAPI(port=18191)
+        await self.api.start()
+        self.addAsyncCleanup(self.api.stop)
+        telebot.asyncio_helper.API_URL = self.api.apiUrl
+        self.sent = []
+        sendMessage = self.api._sendMessage
+        def record(params:dict) -> dict:
+            self.sent.append((int(params["chat_id"]), params["text"]))
+            return sendMessage(params)
+        self.api._sendMessage = record
+        self.workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.workdir.cleanup)
+        persistence.setup(os.path.join(self.workdir.name, "database.db"), ["alice"], "sqlite")
+        persistence.getDatabase().addTelegramGroup("ICT100", "Intro", "https://t.me/+ict100")
+        cfg = config.Config(
+            token="123456:WEBHOOK",
+            admins=["alice"],
+            mode="webhook",
+            webhookUrl="http://127.0.0.1/webhook",
+            webhookSecret=SECRET,
+            floodLimit=0,
+            linkCheckInterval=0,
+        )
+        self.service = service.SingletonService(cfg, logging.getLogger(__name__))
+        self.client = TestClient(TestServer(self.service._webhookApp()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self) -> None:
+        await self.client.close()
+        await self.service._drain()
+        await persistence.getAsyncDatabase().close()
+        # the session of the Bot API client is only opened by the first request to the stub
+        if telebot.asyncio_helper.session_manager.session is not None:
+            await self.service._telebot.close_session()
+
+    async def post(self, body, secret:str=SECRET) -> int:
+        data = body if isinstance(body, (str, bytes)) else json.dumps(body)
+        response = await self.client.post("/webhook", data=data, headers={SECRET_HEADER: secret, "Content-Type": "application/json"})
+        return response.status
+
+    async def replies(self, count:int) -> list:
+        for _ in range(100):
+            if len(self.sent) >= count:
+                break
+            await asyncio.sleep(0.05)
+        return self.sent
+
+    async def testUpdateIsHandled(self) -> None:
+        self.assertEqual(await self.post(command(1, "/get ICT100")), 200)
+        replies = await self.replies(1)
+        self.assertEqual(len(replies), 1)
+        self.assertEqual(replies[0][0], 7)
+        self.assertIn("https://t.me/+ict100", replies[0][1])
+
+    async def testUpdatesOfManyChatsAreHandled(self) -> None:
+        for i in range(20):
+            self.assertEqual(await self.post(command(i + 1, "/get ICT100", chatId=100 + i)), 200)
+        replies = await self.replies(20)
+        self.assertEqual(sorted(chatId for chatId, _ in replies), list(range(100, 120)))
+
+    async def testBadSecretIsRejected(self) -> None:
+        self.assertEqual(await self.post(command(1, "/get ICT100"), secret="wrong"), 403)
+        self.assertEqual(await self.post(command(1, "/get ICT100"), secret=""), 403)
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.sent, [])
+
+    async def testNonAsciiSecretIsRejected(self) -> None:
+        response = await self.client.post("/webhook", data=json.dumps(command(1, "/get ICT100")),
+                                          headers={SECRET_HEADER: "sécret".encode().decode("latin-1")})
+        self.assertEqual(response.status, 403)
+
+    async def testMalformedBodyIsRejected(self) -> None:
+        self.assertEqual(await self.post("{not json"), 400)
+        self.assertEqual(await self.post([command(1, "/get ICT100")]), 400)
+        self.assertEqual(await self.post({"message": command(1, "/get ICT100")["message"]}), 400)
+        self.assertEqual(await self.post("42"), 400)
+
+if __name__ == "__main__":
+    unittest.main()
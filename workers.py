@@ -0,0 +1,299 @@
+from typing import Any, Dict, List, Optional, Tuple
+from multiprocessing.process import BaseProcess
+
+import signal
+import queue
+import asyncio
+import logging
+import multiprocessing
+
+import telebot
+import telebot.asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+from config import Config
+from metrics import getMetrics, startMetricsServer
+from persistence import Change
+import persistence
+import reminders
+import linkhealth
+import monitoring
+import service
+
+_METRICS = getMetrics()
+
+_FETCHER: "Fetcher" = None
+
+# workers are spawned rather than forked, forking a process that runs threads is not safe
+CONTEXT = multiprocessing.get_context("spawn")
+
+def setup(config:Config, logger:logging.Logger, records) -> None:
+    global _FETCHER
+    _FETCHER = Fetcher(config, logger, records)
+
+class FetcherNotReadyException(Exception):
+    pass
+
+def run() -> None:
+    global _FETCHER
+    if _FETCHER is None:
+        raise FetcherNotReadyException()
+    _FETCHER.run()
+
+def chatOf(update:Dict[str, Any]) -> Optional[int]:
+    """
+    Returns the id of the chat of an update, or of the user for updates outside a chat such as inline queries.
+    """
+    for kind in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if kind in update:
+            return update[kind]["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback is not None and "message" in callback:
+        return callback["message"]["chat"]["id"]
+    for value in update.values():
+        if isinstance(value, dict) and "from" in value:
+            return value["from"]["id"]
+    return None
+
+def shardOf(update:Dict[str, Any], workers:int) -> int:
+    chatId = chatOf(update)
+    return 0 if chatId is None else chatId % workers
+
+def applyChange(change:Change) -> None:
+    """
+    Applies a change published by another worker to the state this worker keeps in memory.
+    """
+    kind = change[0]
+    if kind in ("put", "putMany", "delete", "roles"):
+        persistence.getDatabase().applyChange(change)
+    elif kind in ("remind", "subscribe", "unsubscribe", "reminded"):
+        reminders.getReminderScheduler().applyChange(change)
+    elif kind == "health":
+        linkhealth.getLinkChecker().record(change[1], linkhealth.LinkStatus(*change[2]))
+
+class Fetcher:
+    """
+    Long polls for updates in the main process and hands each update to one of workers processes
+    by its chat, so that the updates of a chat are handled in order by the same worker while the
+    workers share the rest. The workers share the SQLite database, and the changes a worker makes
+    to the state it keeps in memory are relayed to the other workers. A worker that dies is restarted.
+    """
+    POLL_TIMEOUT = 20
+    POLL_ERROR_DELAY = 0.25
+    POLL_MAX_ERROR_DELAY = 30.0
+    ACKNOWLEDGE_TIMEOUT = 5
+    SUPERVISE_INTERVAL = 1.0
+    # seconds a worker gets beyond shutdownTimeout to flush the database before it is terminated
+    STOP_GRACE = 10.0
+
+    def __init__(self, config:Config, logger:logging.Logger, records) -> None:
+        self._config = config
+        self._logger = logger
+        self._records = records
+        self._telebot = AsyncTeleBot(config.token)
+        self._updates = [CONTEXT.Queue() for _ in range(config.workers)]
+        self._changes = CONTEXT.Queue()
+        self._processes: List[BaseProcess] = [None] * config.workers
+        # the id after the last update fetched
+        self._offset: Optional[int] = None
+        self._stopping: asyncio.Event = None
+        _METRICS.gauge("bot_workers_alive", lambda: sum(1 for process in self._processes if process is not None and process.is_alive()),
+                       "worker processes running")
+
+    def run(self) -> None:
+        asyncio.run(self.serve())
+
+    def _spawn(self, index:int) -> None:
+        process = CONTEXT.Process(target=runWorker, name=f"worker-{index}", args=(
+            index, self._config, self._updates[index], self._changes, self._records, telebot.asyncio_helper.API_URL,
+        ))
+        process.start()
+        self._processes[index] = process
+
+    def _stop(self, signum:int) -> None:
+        self._logger.info(f"received {signal.Signals(signum).name}, shutting down", extra=monitoring.STATUS)
+        self._stopping.set()
+
+    async def serve(self) -> None:
+        """
+        Starts the workers and fetches updates for them until sent SIGTERM or SIGINT. Then stops
+        fetching, has every worker finish the updates it was given and waits for them to exit.
+        """
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self._stop, signum)
+            except (NotImplementedError, RuntimeError):
+                pass
+        metricsRunner = None
+        if self._config.metricsPort:
+            metricsRunner = await startMetricsServer(self._config.metricsHost, self._config.metricsPort)
+        if self._config.opsChatId is not None:
+            # a digest a minute needs no more than one chat's rate
+            sender = service.SendScheduler(self._telebot, self._logger, self._config.sendChatRate, self._config.sendChatRate,
+                                           self._config.sendChatBurst, 1)
+            await monitoring.getShipper().start(sender.send, self._config.opsChatId, self._config.opsDigestInterval)
+        for index in range(self._config.workers):
+            self._spawn(index)
+        relay = asyncio.create_task(self._relay())
+        supervisor = asyncio.create_task(self._supervise())
+        poller = asyncio.create_task(self._poll())
+        stopping = asyncio.ensure_future(self._stopping.wait())
+        try:
+            await asyncio.wait([poller, stopping], return_when=asyncio.FIRST_COMPLETED)
+            if poller.done():
+                poller.result()
+        finally:
+            stopping.cancel()
+            for task in (poller, supervisor):
+                task.cancel()
+            await asyncio.gather(poller, supervisor, return_exceptions=True)
+            await self._stopWorkers()
+            relay.cancel()
+            await asyncio.gather(relay, return_exceptions=True)
+            for updates in self._updates:
+                # items left for a worker that is gone would otherwise keep this process from exiting
+                updates.cancel_join_thread()
+            if self._config.opsChatId is not None:
+                await monitoring.getShipper().stop()
+            if metricsRunner is not None:
+                await metricsRunner.cleanup()
+            if self._offset is not None:
+                await self._acknowledge()
+            await self._telebot.close_session()
+            self._logger.info("stopped")
+
+    async def _poll(self) -> None:
+        self._logger.info(f"polling for updates for {self._config.workers} workers", extra=monitoring.STATUS)
+        delay = self.POLL_ERROR_DELAY
+        webhookDeleted = False
+        while True:
+            try:
+                if not webhookDeleted:
+                    # a webhook left by an earlier run in webhook mode makes getUpdates fail with 409 Conflict
+                    await self._telebot.delete_webhook()
+                    webhookDeleted = True
+                updates = await telebot.asyncio_helper.get_updates(self._config.token, self._offset, None, self.POLL_TIMEOUT)
+            except Exception as e:
+                self._logger.error(f"failed to get updates: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.POLL_MAX_ERROR_DELAY)
+                continue
+            delay = self.POLL_ERROR_DELAY
+            for update in updates:
+                self._updates[shardOf(update, self._config.workers)].put(("update", update))
+                self._offset = update["update_id"] + 1
+            if updates:
+                _METRICS.inc("bot_updates_fetched_total", len(updates), help="updates fetched for the workers")
+
+    async def _acknowledge(self) -> None:
+        # the updates handed to the workers are only confirmed by the next getUpdates
+        try:
+            await telebot.asyncio_helper.get_updates(self._config.token, self._offset, 1, None, None, self.ACKNOWLEDGE_TIMEOUT)
+        except Exception as e:
+            self._logger.error(f"failed to acknowledge the updates handled: {e}")
+
+    def _nextChange(self) -> Optional[Tuple[int, Change]]:
+        try:
+            return self._changes.get(timeout=1)
+        except queue.Empty:
+            return None
+
+    async def _relay(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self._nextChange)
+            if item is None:
+                continue
+            origin, change = item
+            for index, updates in enumerate(self._updates):
+                if index != origin:
+                    updates.put(("change", change))
+
+    async def _supervise(self) -> None:
+        while True:
+            await asyncio.sleep(self.SUPERVISE_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    # a restarted worker loads the state from the database, so the changes it missed do not matter
+                    self._logger.error(f"worker {index} exited with code {process.exitcode}, restarting it")
+                    _METRICS.inc("bot_worker_restarts_total", help="worker processes restarted after they died")
+                    # the worker may have died holding the lock of its queue, and the updates left on it are lost with it
+                    self._updates[index].cancel_join_thread()
+                    self._updates[index] = CONTEXT.Queue()
+                    self._spawn(index)
+
+    async def _stopWorkers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for updates in self._updates:
+            updates.put(None)
+        deadline = loop.time() + self._config.shutdownTimeout + self.STOP_GRACE
+        for index, process in enumerate(self._processes):
+            await loop.run_in_executor(None, process.join, max(0, deadline - loop.time()))
+            if process.is_alive():
+                self._logger.error(f"terminated worker {index}, still running {self._config.shutdownTimeout + self.STOP_GRACE:g}s after it was stopped")
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+
+def runWorker(index:int, config:Config, updates, changes, records, apiUrl:str) -> None:
+    """
+    Runs worker index in a process started by the fetcher, until the fetcher puts None on its updates queue.
+    """
+    # the fetcher handles the signals and stops the workers through their queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    monitoring.setupWorker(records)
+    telebot.asyncio_helper.API_URL = apiUrl
+    logger = logging.getLogger(f"{__name__}.{index}")
+    # SQLite's WAL journals the writes of all the workers, a journal per worker would replay over theirs
+    persistence.setup(config.database, config.admins, config.backend, config.readers, journal=False, idSuffix=f".{index}")
+    persistence.getDatabase().setPublisher(lambda change: changes.put((index, change)))
+    # the workers share the global send rate, and the fetcher posts the ops digests and serves its metrics on metricsPort
+    config = config._replace(
+        sendGlobalRate=config.sendGlobalRate / config.workers,
+        opsChatId=None,
+        metricsPort=config.metricsPort + 1 + index if config.metricsPort else None,
+    )
+    worker = service.SingletonService(config, logger)
+    asyncio.run(worker.serve(Receiver(index, updates, worker, logger).receive, primary=index == 0))
+
+class Receiver:
+    """
+    Takes the updates and changes the fetcher puts on the queue of a worker. Updates are dispatched
+    in the order they arrive for each chat, and changes are applied at once.
+    """
+    def __init__(self, index:int, updates, worker:service.SingletonService, logger:logging.Logger) -> None:
+        self._index = index
+        self._updates = updates
+        self._worker = worker
+        self._logger = logger
+
+    def _next(self) -> Any:
+        try:
+            return self._updates.get(timeout=1)
+        except queue.Empty:
+            return False
+
+    async def receive(self) -> None:
+        loop = asyncio.get_running_loop()
+        parent = multiprocessing.parent_process()
+        self._logger.info(f"worker {self._index} started")
+        while True:
+            item = await loop.run_in_executor(None, self._next)
+            if item is None:
+                return
+            if item is False:
+                if parent is not None and not parent.is_alive():
+                    self._logger.error(f"worker {self._index} stops because the fetcher is gone")
+                    return
+                continue
+            kind, payload = item
+            if kind == "change":
+                try:
+                    applyChange(payload)
+                except Exception as e:
+                    self._logger.error(f"failed to apply {payload[0]} from another worker: {e}")
+                continue
+            update = telebot.types.Update.de_json(payload)
+            self._worker.dispatch(chatOf(payload) or 0, update)